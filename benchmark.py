@@ -0,0 +1,473 @@
+"""Load-test the bot's real handlers against a fake Telegram Bot API and a scripted price server.
+
+Runs in a throwaway data directory, so it never touches bot_data.json. Example:
+
+    python benchmark.py --users 200 --duration 30 --output bench.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+BOT_TOKEN = "123456:BENCHMARK"
+
+DEFAULT_MIX = {
+    "buy": 3,
+    "sell": 2,
+    "limitbuy": 2,
+    "limitsell": 1,
+    "myorders": 1,
+    "leaderboard": 2,
+    "portfolio": 2,
+    "price": 1,
+}
+
+
+# --- Fake Binance ---
+class PricePath:
+    """A scripted BTC price path, advanced one step per order tick."""
+
+    def __init__(self, kind, start, volatility, seed):
+        self.kind = kind
+        self.start = start
+        self.volatility = volatility
+        self.random = random.Random(seed)
+        self.step = 0
+        self.price = start
+        self.sent_at = {}  # streamed price -> send time, for tick-to-engine latency
+        self.low = self.high = start  # range since the last klines request
+
+    def advance(self):
+        self.step += 1
+        if self.kind == "walk":
+            self.price *= 1 + self.random.gauss(0, self.volatility)
+        elif self.kind == "sine":
+            self.price = self.start * (1 + 10 * self.volatility * math.sin(self.step / 10))
+        elif self.kind == "crash":
+            self.price = self.start * (1 - 0.3 * min(self.step / 50, 1.0))
+        self.low = min(self.low, self.price)
+        self.high = max(self.high, self.price)
+        return self.price
+
+    def take_range(self):
+        low, high = self.low, self.high
+        self.low = self.high = self.price
+        return low, high
+
+
+async def start_price_server(path, port, stream_rate):
+    async def ticker(request):
+        return web.json_response({"symbol": "BTCUSDT", "price": f"{path.price:.2f}"})
+
+    async def klines(request):
+        """One candle covering every price since the previous request."""
+        low, high = path.take_range()
+        start_ms = int(request.query.get("startTime", time.time() * 1000))
+        return web.json_response([[start_ms, f"{low:.2f}", f"{high:.2f}", f"{low:.2f}", f"{path.price:.2f}", "0"]])
+
+    async def trade_stream(request):
+        """Binance-style trade stream: advances the price path stream_rate times per second."""
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        trade_ids = itertools.count(1)
+        try:
+            while not ws.closed:
+                price = path.advance()
+                path.sent_at[round(price, 2)] = time.perf_counter()
+                await ws.send_json({"e": "trade", "s": "BTCUSDT", "t": next(trade_ids), "p": f"{price:.2f}", "q": "0.01"})
+                await asyncio.sleep(1 / stream_rate)
+        except ConnectionResetError:
+            pass
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/api/v3/ticker/price", ticker)
+    app.router.add_get("/api/v3/klines", klines)
+    app.router.add_get("/ws/btcusdt@trade", trade_stream)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+# --- Fake Telegram Bot API ---
+class FakeBotApi:
+    """Answers the Bot API methods the handlers call, with an optional simulated network delay."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = {}
+        self._message_ids = itertools.count(1)
+
+    def _message(self, form):
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(form.get("chat_id", 0)), "type": "private"},
+            "text": form.get("text", ""),
+        }
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        form = await request.post()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getUpdates":
+            # Long poll with nothing to deliver; updates are fed to the application directly
+            await asyncio.sleep(min(float(form.get("timeout", 0) or 0), 1.0))
+            result = []
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(form)
+        elif method == "sendPhoto":
+            result = {**self._message(form), "photo": [{"file_id": "bench", "file_unique_id": "bench", "width": 1, "height": 1}]}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+async def start_bot_api(api, port):
+    app = web.Application()
+    app.router.add_post(f"/bot{BOT_TOKEN}/{{method}}", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+# --- Update construction ---
+_update_ids = itertools.count(1)
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+
+def command_update(user_id, text):
+    command = text.split()[0]
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
+
+
+def callback_update(user_id, data):
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(_update_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "bench",
+            },
+        },
+    }
+
+
+# --- Measurement ---
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(values, scale=1000.0):
+    """p50/p99/max/mean in milliseconds (by default) for a list of durations in seconds."""
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50) * scale, 3),
+        "p99": round(percentile(values, 99) * scale, 3),
+        "max": round(max(values) * scale, 3),
+        "mean": round(sum(values) / len(values) * scale, 3),
+    }
+
+
+async def sample_loop_lag(samples, interval=0.01):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - start - interval))
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+# --- Simulation ---
+async def run(args):
+    price_path = PricePath(args.price_path, args.start_price, args.volatility, args.seed)
+    api = FakeBotApi(args.api_latency / 1000)
+    price_runner = await start_price_server(price_path, args.price_port, args.stream_rate)
+    api_runner = await start_bot_api(api, args.api_port)
+
+    # The bot reads its configuration and data directory at import time
+    os.environ["BINANCE_PRICE_URL"] = f"http://127.0.0.1:{args.price_port}/api/v3/ticker/price"
+    os.environ["BINANCE_KLINES_URL"] = f"http://127.0.0.1:{args.price_port}/api/v3/klines?symbol=BTCUSDT&interval=1s"
+    os.environ["PRICE_STREAM_URL"] = f"ws://127.0.0.1:{args.price_port}/ws/btcusdt@trade"
+    data_dir = tempfile.mkdtemp(prefix="gkc-bench-")
+    os.chdir(data_dir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import_start = time.perf_counter()
+    import goldkingcoinersbot as bot
+    import_time = time.perf_counter() - import_start
+    load_start = time.perf_counter()
+    bot.init()
+    load_time = time.perf_counter() - load_start
+
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    if not args.rate_limits:
+        bot.RATE_LIMITER.limits = {name: (1e9, 1e9) for name in bot.RATE_LIMITER.limits}
+
+    application = (
+        bot.application_builder(BOT_TOKEN, args.max_concurrent)
+        .base_url(f"http://127.0.0.1:{args.api_port}/bot")
+        .build()
+    )
+    bot.add_handlers(application)
+
+    # Updates go through the application's queue and update processor, as in production, and count as
+    # finished when a catch-all handler in a later group sees them
+    handled = {}  # update_id -> future
+    webhook_session = None
+
+    async def mark_handled(update, context):
+        future = handled.pop(update.update_id, None)
+        if future is not None:
+            future.set_result(None)
+
+    application.add_handler(TypeHandler(Update, mark_handled), group=1)
+
+    latencies = {}
+    errors = 0
+    loop_lag = []
+    tick_durations = []
+    orders_per_tick = []
+    save_durations = []
+    snapshot_bytes = None
+
+    async def dispatch(command, payload):
+        nonlocal errors
+        start = time.perf_counter()
+        future = handled[payload["update_id"]] = asyncio.get_running_loop().create_future()
+        try:
+            if args.webhook:
+                # Time from posting the update, as Telegram would, until the bot has handled it
+                async with webhook_session.post(f"http://127.0.0.1:{args.webhook_port}/telegram", json=payload) as response:
+                    response.raise_for_status()
+            else:
+                # Queued like the updater does with polled updates, so the per-user concurrency limits apply
+                await application.update_queue.put(Update.de_json(payload, application.bot))
+            await asyncio.wait_for(future, timeout=30)
+        except Exception:
+            handled.pop(payload["update_id"], None)
+            errors += 1
+        latencies.setdefault(command, []).append(time.perf_counter() - start)
+
+    rng = random.Random(args.seed)
+    mix = json.loads(args.mix) if args.mix else DEFAULT_MIX
+    commands, weights = zip(*mix.items())
+    deadline = None
+
+    async def simulate_user(user_id):
+        await dispatch("register", command_update(user_id, f"/register bench{user_id}"))
+        while time.perf_counter() < deadline:
+            command = rng.choices(commands, weights)[0]
+            current = price_path.price
+            if command in ("buy", "sell"):
+                await dispatch(command, command_update(user_id, f"/{command}"))
+                await dispatch(f"{command}_callback", callback_update(user_id, f"{command}_{rng.choice([5, 10, 25])}"))
+            elif command == "limitbuy":
+                limit = current * rng.uniform(0.97, 1.01)
+                await dispatch(command, command_update(user_id, f"/limitbuy {limit:.2f} {rng.uniform(50, 500):.2f}"))
+            elif command == "limitsell":
+                limit = current * rng.uniform(0.99, 1.03)
+                await dispatch(command, command_update(user_id, f"/limitsell {limit:.2f} 0.001"))
+            elif command == "alert":
+                direction, level = rng.choice([("above", 1.01), ("below", 0.99)])
+                await dispatch(command, command_update(user_id, f"/alert {direction} {current * level:.2f}"))
+            else:
+                await dispatch(command, command_update(user_id, f"/{command}"))
+            await asyncio.sleep(rng.expovariate(1 / args.think_time))
+
+    async def drive_ticks():
+        if args.stream:
+            return  # the stream server advances the price and the bot's engine runs on each tick
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(args.tick_interval)
+            # Several exchange moves per tick; only the last one is polled, the rest come in via klines
+            for _ in range(args.moves_per_tick):
+                price_path.advance()
+            await bot.refresh_btc_price()
+            await bot.refresh_price_range()
+
+            start = time.perf_counter()
+            executed = await bot.process_limit_orders(application)
+            tick_durations.append(time.perf_counter() - start)
+            orders_per_tick.append(len(executed))
+
+    stream_lag = []
+    if args.stream:
+        # Time from the fake exchange sending a price to the order engine evaluating it
+        original_process = bot.process_limit_orders
+
+        async def timed_process(context=None):
+            start = time.perf_counter()
+            executed = await original_process(context)
+            tick_durations.append(time.perf_counter() - start)
+            orders_per_tick.append(len(executed))
+            sent_at = price_path.sent_at.pop(round(bot._last_price, 2), None)
+            if sent_at is not None:
+                stream_lag.append(start - sent_at)
+            return executed
+
+        bot.process_limit_orders = timed_process
+
+    async with application:
+        await application.start()
+        if args.webhook:
+            webhook_runner = await bot.start_webhook_server(application, "127.0.0.1", args.webhook_port, "/telegram")
+            webhook_session = aiohttp.ClientSession()
+        else:
+            # Poll like the real bot so the first-poll hook (startup report, import warm-up) runs
+            await application.updater.start_polling(timeout=1)
+        bot.BROADCASTER.start(application.bot)
+        await bot.refresh_btc_price()
+        if args.stream:
+            bot.start_price_stream(application)
+        lag_task = asyncio.create_task(sample_loop_lag(loop_lag))
+
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(drive_ticks(), *(simulate_user(1000 + i) for i in range(args.users)))
+
+        for _ in range(args.save_samples):
+            start = time.perf_counter()
+            bot.save_data()
+            save_durations.append(time.perf_counter() - start)
+        snapshot_bytes = bot.METRICS.gauges.get(("snapshot_bytes", ()), 0)
+
+        lag_task.cancel()
+        if not args.webhook:
+            await application.updater.stop()
+            if bot._warmup_task is None:
+                raise RuntimeError("polling never reached the first-poll hook; the import warm-up did not start")
+            await bot._warmup_task
+        await bot.stop_price_stream()
+        await bot.BROADCASTER.stop()
+        await bot.close_price_session()
+        if args.webhook:
+            await webhook_session.close()
+            await webhook_runner.cleanup()
+        await application.stop()
+
+    await price_runner.cleanup()
+    await api_runner.cleanup()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "revision": git_revision(),
+        "config": {**vars(args), "storage": bot.STORAGE_BACKEND, "order_matching": bot.ORDER_MATCHING},
+        "import_seconds": round(import_time, 3),
+        "load_seconds": round(load_time, 3),
+        "startup_seconds": {phase: round(seconds, 3) for phase, seconds in bot.STARTUP_TIMES.items()},
+        "handler_latency_ms": {"all": summarize(all_latencies), **{k: summarize(v) for k, v in sorted(latencies.items())}},
+        "handler_errors": errors + sum(v for (name, _), v in bot.METRICS.counters.items() if name == "handler_errors_total"),
+        "throughput_per_second": round(len(all_latencies) / args.duration, 1),
+        "event_loop_lag_ms": summarize(loop_lag),
+        "order_tick_ms": summarize(tick_durations),
+        "orders_per_tick": {
+            "ticks": len(orders_per_tick),
+            "mean": round(sum(orders_per_tick) / len(orders_per_tick), 2) if orders_per_tick else 0,
+            "max": max(orders_per_tick, default=0),
+        },
+        "stream": {
+            "messages": bot.METRICS.counters.get(("price_stream_messages_total", ()), 0),
+            "engine_runs": bot.METRICS.counters.get(("order_engine_runs_total", ()), 0),
+            "tick_to_engine_ms": summarize(stream_lag),
+        } if args.stream else None,
+        "open_orders_at_end": len(bot.LIMIT_ORDERS),
+        "save_data_ms": summarize(save_durations),
+        "snapshot_bytes": snapshot_bytes,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "bot_api_calls": api.calls,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100, help="concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of simulated traffic")
+    parser.add_argument("--think-time", type=float, default=0.5, help="mean seconds between a user's commands")
+    parser.add_argument("--mix", help='JSON command weights, e.g. \'{"buy": 1, "leaderboard": 3}\'')
+    parser.add_argument("--price-path", choices=["walk", "sine", "crash"], default="walk")
+    parser.add_argument("--start-price", type=float, default=100000.0)
+    parser.add_argument("--volatility", type=float, default=0.002, help="per-tick price change scale")
+    parser.add_argument("--moves-per-tick", type=int, default=5, help="price path steps between order engine ticks")
+    parser.add_argument("--tick-interval", type=float, default=1.0, help="seconds between order engine ticks")
+    parser.add_argument("--stream", action="store_true", help="drive the order engine from a WebSocket trade stream")
+    parser.add_argument("--stream-rate", type=float, default=20.0, help="streamed trades per second")
+    parser.add_argument("--webhook", action="store_true", help="post updates to the bot's webhook server instead of calling it directly")
+    parser.add_argument("--webhook-port", type=int, default=18082)
+    parser.add_argument("--max-concurrent", type=int, default=64, help="updates the bot handles at once")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API latency in ms")
+    parser.add_argument("--save-samples", type=int, default=5, help="full snapshots timed at the end")
+    parser.add_argument("--rate-limits", action="store_true", help="keep the bot's per-user rate limits on")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--price-port", type=int, default=18080)
+    parser.add_argument("--api-port", type=int, default=18081)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    report = asyncio.run(run(args))
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,130 @@
+import time
+_import_started = time.perf_counter()
 import os
 import logging
 import json
-import time
-from datetime import datetime
-import requests
+from datetime import datetime, timedelta
+import aiohttp
+from aiohttp import web
 from dotenv import load_dotenv
 from telegram import Update
-from telegram.ext import ApplicationBuilder, CallbackQueryHandler, CommandHandler, ContextTypes
+from telegram.ext import ApplicationBuilder, BaseUpdateProcessor, CallbackQueryHandler, CommandHandler, ContextTypes
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-import ccxt
-import pandas as pd
-import mplfinance as mpf
+from telegram.request import HTTPXRequest
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError, TimedOut
+import numpy as np
 from telegram.ext import CallbackContext
 from functools import wraps
-import matplotlib
-matplotlib.use('Agg')  # Use non-GUI backend
+from contextlib import contextmanager
 from html import escape
 from typing import Dict, List
 from uuid import uuid4
 import asyncio
-import feedparser
-from rapidfuzz import fuzz
+import math
+import struct
+from array import array
+from collections import Counter, OrderedDict, defaultdict, deque
+import io
+import multiprocessing
+import signal
+import sqlite3
+import sys
+import tempfile
+from urllib.parse import urlparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import bisect
+import importlib
 # --- Configuration ---
 
 load_dotenv("bot_token.env")
 TOKEN = os.getenv("BOT_TOKEN")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))  # Prometheus endpoint on localhost; 0 disables it
+ADMIN_IDS = {uid.strip() for uid in os.getenv("ADMIN_IDS", "").split(",") if uid.strip()}
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # 'polling' or 'webhook'
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public HTTPS URL Telegram posts updates to, e.g. https://example.com/telegram
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")  # local server behind the TLS-terminating proxy
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # checked against X-Telegram-Bot-Api-Secret-Token
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))  # updates handled at once; one user's run in order
 
 TRADE_FEE = 0.001  # 0.1%
-user_last_interaction = {}
-COOLDOWN_TIME = 1.0
+RATE_LIMITS = {  # command class -> (burst size, tokens refilled per second)
+    'default': (3, 1.0),
+    'light': (5, 2.0),  # cheap reads like /price
+    'heavy': (1, 1 / 15),  # /chart and /news
+    'callback': (4, 2.0),  # inline button presses
+}
+RATE_LIMIT_MAX_ENTRIES = 50000
+RATE_LIMIT_IDLE_TTL = 600.0  # seconds before an idle bucket is forgotten
 MIN_TRADE_AMOUNT = 1.0  # minimum USD value for any trade
+STARTING_USD = 100000.0  # balance every trader registers with; PnL is measured against it
+MICROS_PER_USD = 1_000_000  # balances are integer micro-dollars and satoshis
+SATS_PER_BTC = 100_000_000
+CONTEST_PNL_TARGET = float(os.getenv("CONTEST_PNL_TARGET", "3000"))  # PnL that wins the prize
+CONTEST_PRIZE = os.getenv("CONTEST_PRIZE", "0.25 mBTC")
+CONTEST_AUTO_AWARD = os.getenv("CONTEST_AUTO_AWARD", "0") == "1"  # award the first trader to reach the target instead of waiting for /claimprize
+ORDER_TICK_INTERVAL = 30.0  # seconds between limit/stop order checks
+FILL_MODEL = os.getenv("FILL_MODEL", "trigger")  # 'trigger': stops fill at their trigger; 'slippage': worse by STOP_SLIPPAGE_BPS
+STOP_SLIPPAGE_BPS = float(os.getenv("STOP_SLIPPAGE_BPS", "5"))
+ORDER_MATCHING = os.getenv("ORDER_MATCHING", "index")  # 'index': bisect per type; 'vector': NumPy columns with bulk fills
+_last_order_tick = None
+
+# --- Price Service ---
+BINANCE_PRICE_URL = os.getenv("BINANCE_PRICE_URL", "https://api.binance.com/api/v3/ticker/price?symbol=BTCUSDT")
+PRICE_REFRESH_INTERVAL = 15.0  # seconds between background refreshes
+PRICE_MAX_AGE = 30.0  # a cached price older than this triggers a refresh on read
+PRICE_HTTP_TIMEOUT = 10.0
+PRICE_JOURNAL_INTERVAL = 30.0  # journal the price at most this often; streamed ticks are far more frequent
+LEADERBOARD_REFRESH_INTERVAL = 10.0  # seconds a leaderboard ranking is reused while the price keeps moving
+PRICE_STREAM_ENABLED = os.getenv("PRICE_STREAM", "0") == "1"
+PRICE_STREAM_URL = os.getenv("PRICE_STREAM_URL", "wss://stream.binance.com:9443/ws/btcusdt@trade")
+BINANCE_KLINES_URL = os.getenv("BINANCE_KLINES_URL", "https://api.binance.com/api/v3/klines?symbol=BTCUSDT&interval=1s")
+ORDER_ENGINE_MIN_INTERVAL = 0.05  # seconds between streamed order engine runs; ticks in between are coalesced
+_price_session = None
+_price_refresh_task = None
+_price_journaled_at = 0.0
+_range_low = None  # lowest/highest price seen since the order engine last ran
+_range_high = None
+_range_started_at = time.time()
+_price_stream_task = None
+_order_engine_task = None
+_order_engine_wakeup = asyncio.Event()
 
 # --- Data Management ---
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")  # 'json': snapshot + journal; 'sqlite': SQLITE_FILE in WAL mode
 DATA_FILE = 'bot_data.json'
+JOURNAL_FILE = 'bot_data.journal'
+SQLITE_FILE = 'bot_data.sqlite3'
+COMPACT_INTERVAL = 300.0  # seconds between background snapshots
+COMPACT_MIN_RECORDS = 1  # skip the snapshot if fewer records were journaled since the last one
+_journal_seq = 0
+_journal_pending = 0
+_journal_batch_depth = 0
+ENGINE_LOCK = asyncio.Lock()  # one order engine pass or snapshot at a time
+SNAPSHOT_LOCK = asyncio.Lock()  # held for a whole snapshot, including its write in the I/O pool
+TRADES_DIR = 'trades'  # one binary trade history file per user
+TRADE_CACHE_SIZE = 256  # users whose full history is kept in memory as columns
+HISTORY_PAGE_SIZE = 15
+CANDLES_FILE = 'candles_1m.bin'  # memory-mapped 1-minute OHLCV archive
+CANDLE_HISTORY_MINUTES = 90 * 24 * 60  # how far back the archive starts, and the longest chart window
+CANDLE_BACKFILL_LIMIT = 1000  # candles per exchange request
+CANDLE_FLUSH_INTERVAL = 5  # seconds the open candle may sit in memory before it's written to the archive
+USERS = {}  # filled by init()
+_last_price = None
+_last_price_time = 0
 ORDERS = []
 LIMIT_ORDERS = {}
+ALERTS = {}  # alert_id -> user, direction ('above'/'below') and price level
+MAX_ALERTS_PER_USER = 10
 WINNER_ID = None
 WINNER_ANNOUNCED = False
+BROADCASTS = {}  # broadcast_id -> text, recipient chat ids and send progress
+BROADCAST_RATE = 25.0  # messages per second, under Telegram's ~30/s global limit
+BROADCAST_PER_CHAT_INTERVAL = 1.0  # Telegram allows about one message per second per chat
+BROADCAST_MAX_ATTEMPTS = 5
+BROADCAST_JOURNAL_EVERY = 100  # sends between journaled broadcast cursors; a restart may resend up to this many
+BROADCAST_JOURNAL_INTERVAL = 1.0  # seconds; the cursor is journaled at least this often while sending
+BLOCKED_CHATS = set()  # chat ids that blocked the bot or were deactivated; skipped until they write again
 RSS_FEEDS = {
     "CoinDesk": "https://www.coindesk.com/arc/outboundfeeds/rss/",
     "CoinTelegraph": "https://cointelegraph.com/rss",
@@ -44,112 +132,1602 @@ RSS_FEEDS = {
     "CryptoSlate": "https://cryptoslate.com/feed/",
     "Decrypt": "https://decrypt.co/feed",
 }
+NEWS_REFRESH_INTERVAL = 300.0  # seconds between feed polls
+NEWS_FEED_TIMEOUT = 10.0  # per-feed request timeout
+NEWS_STALE_AFTER = 1800.0  # warn in /news when a feed hasn't answered for this long
+_news_session = None
+_metrics_runner = None
+_news_feeds = {}  # source name -> etag, last-modified, parsed entries, last success time
+_news_started = time.time()  # counts as the last success of a feed that hasn't answered yet
+_news_text = None
+IO_WORKERS = 8  # threads for blocking file writes and parsing
+IO_QUEUE = 64  # jobs waiting for an I/O thread before new ones are turned away
+CHART_WORKERS = 1  # processes rendering the shared, cacheable charts off the event loop
+CHART_QUEUE = 4  # shared renders waiting for a worker before /chart answers busy
+PERSONAL_CHART_WORKERS = 2  # separate pool for charts with a user's trades, so they can't delay shared ones
+PERSONAL_CHART_QUEUE = 4  # personal renders waiting for a worker before /chart ... me answers busy
+CHART_TIMEFRAMES = {'15m': (15, '15min'), '1h': (60, '1h'), '4h': (240, '4h'), '1d': (1440, '1D')}  # minutes, pandas rule
+CHART_WINDOW_UNITS = {'h': 60, 'd': 1440, 'w': 10080}
+CHART_DEFAULT_TIMEFRAME = '1h'
+CHART_DEFAULT_WINDOW = '7d'
+CHART_MAX_CANDLES = 500
+CHART_CACHE_SIZE = 16  # shared chart views kept as PNG + Telegram file_id
+_personal_chart_jobs = set()  # users with a personal render in flight
+_chart_render_tasks = {}  # (timeframe, window) -> in-flight shared render
+_chart_cache = OrderedDict()  # (timeframe, window) -> {'key', 'png', 'file_id'}, least recently used first
+_candle_frames = {}  # timeframe -> (open candle start, first minute, closed candles); per process
+
+# --- Metrics ---
+class Histogram:
+    """Fixed-bucket histogram; observing is one bisect and a few additions."""
+
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (None if empty)."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """In-process counters, gauges and histograms, exported in Prometheus text format."""
+
+    def __init__(self):
+        self.counters = defaultdict(float)  # (name, labels) -> value
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        self.counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def set(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render_prometheus(self):
+        lines = []
+        for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+            for name in sorted({name for name, _ in series}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (series_name, labels), value in series.items():
+                    if series_name == name:
+                        lines.append(f"{name}{self._labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (series_name, labels), histogram in self.histograms.items():
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
 
-def rate_limit_decorator(func):
+
+METRICS = Metrics()
+
+
+def instrumented(func):
+    """Record latency and errors of a command or callback handler."""
     @wraps(func)
-    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
-        user_id = str(update.effective_user.id)  # User identifier
-        current_time = time.time()  # Current time in seconds
-
-        # Check if user has already interacted recently
-        if user_id in user_last_interaction:
-            last_interaction_time = user_last_interaction[user_id]
-            if current_time - last_interaction_time < COOLDOWN_TIME:
-                # Inform the user that they are sending commands too quickly
-                
+    async def wrapper(update, context, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(update, context, *args, **kwargs)
+        except Exception:
+            METRICS.inc('handler_errors_total', handler=func.__name__)
+            raise
+        finally:
+            METRICS.observe('handler_seconds', time.perf_counter() - start, handler=func.__name__)
+
+    return wrapper
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """Bot API transport that times every outbound Telegram call by method."""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            METRICS.inc('telegram_requests_total', method=endpoint, status='error')
+            raise
+        METRICS.observe('telegram_request_seconds', time.perf_counter() - start, method=endpoint)
+        METRICS.inc('telegram_requests_total', method=endpoint, status=code)
+        # The first answered getUpdates, or setWebhook in webhook mode, marks the bot as serving
+        if endpoint in ('getUpdates', 'setWebhook') and 'first_poll' not in STARTUP_TIMES:
+            on_first_poll()
+        return code, payload
+
+
+# --- Offload Pools ---
+class PoolBusy(Exception):
+    """An offload pool's queue is full; answer 'busy' instead of waiting."""
+
+
+def _timed_call(func, args):
+    """Run a job in a worker and report when it started and finished (monotonic is system-wide on Linux)."""
+    started = time.monotonic()
+    try:
+        result = func(*args)
+    except Exception as e:
+        return started, time.monotonic(), None, e
+    return started, time.monotonic(), result, None
+
+
+class OffloadPool:
+    """A bounded executor for blocking work, with admission control on its queue depth.
+
+    Every job records how long it waited for a worker and how long it ran.
+    """
+
+    def __init__(self, name, make_executor, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.depth = 0  # jobs running or waiting
+        self._make_executor = make_executor
+        self._executor = None
+
+    def busy(self):
+        return self.depth >= self.workers + self.max_queue
+
+    async def run(self, func, *args, admit=True):
+        """Run func(*args) in the pool. With admit, raise PoolBusy rather than queue behind a full pool."""
+        if admit and self.busy():
+            METRICS.inc('offload_rejected_total', pool=self.name)
+            raise PoolBusy(self.name)
+        if self._executor is None:
+            self._executor = self._make_executor(self.workers)
+
+        self.depth += 1
+        METRICS.set('offload_queue_depth', self.depth, pool=self.name)
+        submitted = time.monotonic()
+        try:
+            loop = asyncio.get_running_loop()
+            started, finished, result, error = await loop.run_in_executor(self._executor, _timed_call, func, args)
+        finally:
+            self.depth -= 1
+            METRICS.set('offload_queue_depth', self.depth, pool=self.name)
+
+        METRICS.observe('offload_wait_seconds', started - submitted, pool=self.name)
+        METRICS.observe('offload_run_seconds', finished - started, pool=self.name)
+        if error is not None:
+            METRICS.inc('offload_errors_total', pool=self.name)
+            raise error
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _thread_pool(workers):
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='offload')
+
+
+def _process_pool(workers):
+    # Not 'fork': this process has I/O threads, a SQLite connection and the open journal, and a
+    # child forked while another thread holds a lock can deadlock on it
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method),
+                               initializer=_init_chart_worker, initargs=(os.path.abspath(CANDLES_FILE),))
+
+
+def _init_chart_worker(candles_path):
+    """Set up a fresh chart worker: read the parent's candle archive and import the chart libraries."""
+    CANDLE_ARCHIVE.path = candles_path
+    import_mplfinance()
+    importlib.import_module('ccxt')
+
+
+IO_POOL = OffloadPool('io', _thread_pool, IO_WORKERS, IO_QUEUE)
+CHART_POOL = OffloadPool('chart', _process_pool, CHART_WORKERS, CHART_QUEUE)
+PERSONAL_CHART_POOL = OffloadPool('personal_chart', _process_pool, PERSONAL_CHART_WORKERS, PERSONAL_CHART_QUEUE)
+
+
+def shutdown_offload_pools():
+    for pool in (IO_POOL, CHART_POOL, PERSONAL_CHART_POOL):
+        pool.shutdown()
+
+
+class RateLimiter:
+    """Per-user token buckets for each command class, with LRU/idle eviction to bound memory."""
+
+    def __init__(self, limits, max_entries, idle_ttl):
+        self.limits = limits
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.rejections = Counter()  # command name -> rejected calls
+        self._buckets = OrderedDict()  # (user_id, command class) -> [tokens, last update], least recent first
+
+    def allow(self, user_id, command_class, command):
+        capacity, refill_rate = self.limits[command_class]
+        now = time.monotonic()
+        key = (user_id, command_class)
+
+        bucket = self._buckets.pop(key, None)
+        tokens = capacity if bucket is None else min(capacity, bucket[0] + (now - bucket[1]) * refill_rate)
+
+        allowed = tokens >= 1.0
+        if allowed:
+            tokens -= 1.0
+        else:
+            self.rejections[command] += 1
+
+        self._buckets[key] = [tokens, now]
+        self._evict(now)
+        return allowed
+
+    def _evict(self, now):
+        # An evicted bucket comes back full, so the idle TTL must exceed the slowest refill time
+        while self._buckets:
+            key, (tokens, last_update) = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_entries and now - last_update < self.idle_ttl:
+                break
+            del self._buckets[key]
+
+
+RATE_LIMITER = RateLimiter(RATE_LIMITS, RATE_LIMIT_MAX_ENTRIES, RATE_LIMIT_IDLE_TTL)
+
+
+def rate_limited(command_class='default'):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+            user_id = str(update.effective_user.id)  # User identifier
+
+            if not RATE_LIMITER.allow(user_id, command_class, func.__name__):
+                # Button presses still need an answer or the client keeps spinning
+                if update.callback_query:
+                    await update.callback_query.answer("⏳ Slow down a little.")
                 return  # Prevent the command from executing if it's too fast
 
-        # Update the last interaction time for the user
-        user_last_interaction[user_id] = current_time
+            if user_id in BLOCKED_CHATS:
+                unblock_chat(user_id)  # writing to the bot means they unblocked it
 
-        # Call the original function (the command handler)
-        return await func(update, context, *args, **kwargs)
+            # Call the original function (the command handler)
+            return await func(update, context, *args, **kwargs)
+
+        return wrapper
+    return decorator
+
+
+rate_limit_decorator = rate_limited('default')
+
+# --- Accounts ---
+def to_micros(usd):
+    return round(usd * MICROS_PER_USD)
+
+def to_sats(btc):
+    return round(btc * SATS_PER_BTC)
+
+
+class TradeStats:
+    """Running per-user accumulators, updated on every fill so /stats never reads the trade history."""
+
+    __slots__ = (
+        'cost',  # USD paid, fees included, for the BTC still held
+        'realized',  # net sale proceeds minus the cost of the BTC sold
+        'fees',
+        'trades',
+        'volume',  # gross USD traded
+        'sells',
+        'wins',  # sells realized at a profit
+        'peak',  # highest portfolio value seen at a fill
+        'max_drawdown',  # largest fall from that peak, as a fraction
+    )
+
+    def __init__(self, cost=0.0, realized=0.0, fees=0.0, trades=0, volume=0.0, sells=0, wins=0,
+                 peak=STARTING_USD, max_drawdown=0.0):
+        self.cost = cost
+        self.realized = realized
+        self.fees = fees
+        self.trades = trades
+        self.volume = volume
+        self.sells = sells
+        self.wins = wins
+        self.peak = peak
+        self.max_drawdown = max_drawdown
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Account:
+    """A trader's balances in integer micro-dollars and satoshis, so repeated fees leave no float drift.
+
+    Slots instead of a dict per user; from_dict/to_dict keep the JSON snapshot layout unchanged.
+    """
+
+    __slots__ = ('usd_micros', 'sats', 'nickname', 'username', 'number', 'stats', 'extra')
+
+    def __init__(self, usd_micros, sats, nickname, username, number, stats=None, extra=None):
+        self.usd_micros = usd_micros
+        self.sats = sats
+        self.nickname = nickname
+        self.username = username
+        self.number = number
+        self.stats = stats  # TradeStats, or None until rebuilt from the trade history
+        self.extra = extra  # fields this version doesn't know, kept for the round trip
+
+    @property
+    def usd(self):
+        return self.usd_micros / MICROS_PER_USD
+
+    @property
+    def btc(self):
+        return self.sats / SATS_PER_BTC
+
+    @property
+    def display_name(self):
+        return self.nickname or f"Trader {self.number}"
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        stats = data.pop('stats', None)
+        return cls(
+            to_micros(data.pop('usd')),
+            to_sats(data.pop('btc')),
+            data.pop('nickname', None),
+            data.pop('username', None),
+            data.pop('number'),
+            TradeStats.from_dict(stats) if stats else None,
+            data or None,
+        )
+
+    def to_dict(self):
+        data = {
+            'usd': self.usd,
+            'btc': self.btc,
+            'nickname': self.nickname,
+            'username': self.username,
+            'number': self.number,
+        }
+        if self.stats is not None:
+            data['stats'] = self.stats.to_dict()
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+# --- Storage Backends ---
+class JsonStorage:
+    """A JSON snapshot plus an append-only journal of the mutations made since it."""
+
+    def __init__(self, data_file, journal_file):
+        self.data_file = data_file
+        self.journal_file = journal_file
+        self._file = None
+
+    def load(self):
+        """Return (snapshot dict, journal records newer than the snapshot)."""
+        data = {}
+        try:
+            if os.path.exists(self.data_file) and os.path.getsize(self.data_file) > 0:
+                with open(self.data_file, 'r') as f:
+                    data = json.load(f)
+            else:
+                logger.warning(f"Data file {self.data_file} is empty or doesn't exist. Initializing new data.")
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            logger.error(f"Error loading data: {e}")
+        return data, self._records(data.get('journal_seq', 0))
+
+    def _records(self, after_seq):
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from a crash mid-write; nothing after it was acknowledged
+                    logger.warning("Ignoring truncated journal record.")
+                    return
+                if record['seq'] > after_seq:
+                    yield record
+
+    def append(self, record):
+        """Write one record; returns the bytes written. Reaches the file on flush()."""
+        if self._file is None:
+            self._file = open(self.journal_file, 'a')
+        line = json.dumps(record) + '\n'
+        self._file.write(line)
+        return len(line)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def snapshot(self, data):
+        """Write the full state and truncate the journal it now covers; returns the snapshot size."""
+        payload, covered = self.begin_snapshot(data)
+        self.finish_snapshot(self.write_snapshot(payload, covered))
+        return len(payload)
+
+    def begin_snapshot(self, data):
+        """Serialize the state; returns (payload, journal offset the payload covers). Call on the event loop."""
+        self.flush()
+        covered = self._file.tell() if self._file is not None else 0
+        return json.dumps(data), covered
+
+    @staticmethod
+    def _write_temp(path, data):
+        """Write bytes to a unique fsynced temp file next to path, to be renamed over it; returns its name."""
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(tmp_file)
+            raise
+        return tmp_file
+
+    def _read_journal(self, offset):
+        try:
+            with open(self.journal_file, 'rb') as f:
+                f.seek(offset)
+                return f.read()
+        except FileNotFoundError:
+            return b''
+
+    def write_snapshot(self, payload, covered):
+        """Write the snapshot file and stage the journal records it doesn't cover. Safe to run in a thread.
+
+        Returns (staged journal file, journal offset it runs to) for finish_snapshot.
+        """
+        os.replace(self._write_temp(self.data_file, payload.encode()), self.data_file)
+        tail = self._read_journal(covered)
+        tail = tail[:tail.rfind(b'\n') + 1]  # a record being appended right now is left to finish_snapshot
+        return self._write_temp(self.journal_file, tail), covered + len(tail)
+
+    def finish_snapshot(self, staged):
+        """Swap in the staged journal plus the few records appended since it was staged. Call on the event loop."""
+        # Records up to journal_seq are in the snapshot; replay skips them even if this fails
+        tmp_file, staged_end = staged
+        try:
+            self.flush()
+            with open(tmp_file, 'ab') as f:
+                f.write(self._read_journal(staged_end))  # flushed like any other append, not fsynced
+            os.replace(tmp_file, self.journal_file)
+        except BaseException:
+            os.unlink(tmp_file)
+            raise
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.journal_file, 'a')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class SQLiteStorage:
+    """Indexed tables in one SQLite database in WAL mode; journal records become row changes.
+
+    Changes collect in one open transaction and are committed on flush(), so a batch of
+    records costs one commit.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            number INTEGER NOT NULL,
+            username TEXT,
+            nickname TEXT,
+            usd REAL NOT NULL,
+            btc REAL NOT NULL,
+            extra TEXT NOT NULL DEFAULT '{}'
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS users_nickname ON users (nickname COLLATE NOCASE) WHERE nickname != '';
+        CREATE TABLE IF NOT EXISTS orders (
+            order_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            type TEXT NOT NULL,
+            price REAL NOT NULL,
+            amount REAL NOT NULL,
+            usd_amount REAL NOT NULL,
+            created_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS orders_user ON orders (user_id, created_at);
+        CREATE INDEX IF NOT EXISTS orders_trigger ON orders (type, price);
+        CREATE TABLE IF NOT EXISTS trades (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            side INTEGER NOT NULL,
+            btc REAL NOT NULL,
+            usd REAL NOT NULL,
+            price REAL NOT NULL,
+            fee REAL NOT NULL,
+            timestamp REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS trades_user_time ON trades (user_id, timestamp);
+        CREATE TABLE IF NOT EXISTS alerts (
+            alert_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            direction TEXT NOT NULL,
+            price REAL NOT NULL,
+            created_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS alerts_user ON alerts (user_id, created_at);
+        CREATE TABLE IF NOT EXISTS broadcasts (broadcast_id TEXT PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS blocked_chats (chat_id TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """
+    USER_COLUMNS = ('number', 'username', 'nickname', 'usd', 'btc')
+    ORDER_COLUMNS = ('user_id', 'type', 'price', 'amount', 'usd_amount', 'created_at')
+    ALERT_COLUMNS = ('user_id', 'direction', 'price', 'created_at')
+
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+        self.dirty = False
+
+    def open(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")  # WAL commits survive a process crash without an fsync each
+            self.db.executescript(self.SCHEMA)
+
+    def _get_meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def load(self):
+        self.open()
+        users = {}
+        for user_id, number, username, nickname, usd, btc, extra in self.db.execute(
+                "SELECT user_id, number, username, nickname, usd, btc, extra FROM users ORDER BY number"):
+            users[user_id] = {**json.loads(extra), 'usd': usd, 'btc': btc, 'nickname': nickname,
+                              'username': username, 'number': number}
+
+        orders = {}
+        for order_id, *values in self.db.execute(
+                f"SELECT order_id, {', '.join(self.ORDER_COLUMNS)} FROM orders ORDER BY created_at"):
+            orders[order_id] = dict(zip(self.ORDER_COLUMNS, values))
+
+        alerts = {}
+        for alert_id, *values in self.db.execute(
+                f"SELECT alert_id, {', '.join(self.ALERT_COLUMNS)} FROM alerts ORDER BY created_at"):
+            alerts[alert_id] = dict(zip(self.ALERT_COLUMNS, values))
+
+        data = {
+            'users': users,
+            'limit_orders': orders,
+            'alerts': alerts,
+            'broadcasts': {bid: json.loads(value) for bid, value in self.db.execute("SELECT broadcast_id, data FROM broadcasts")},
+            'blocked_chats': [chat_id for chat_id, in self.db.execute("SELECT chat_id FROM blocked_chats")],
+            'price_data': self._get_meta('price_data', {}),
+            'winner_id': self._get_meta('winner_id'),
+            'winner_announced': self._get_meta('winner_announced', False),
+            'journal_seq': self._get_meta('journal_seq', 0),
+        }
+        return data, iter(())
+
+    def _put_user(self, user_id, user):
+        extra = {k: v for k, v in user.items() if k not in self.USER_COLUMNS}
+        self.db.execute(
+            "INSERT OR REPLACE INTO users (user_id, number, username, nickname, usd, btc, extra) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, user['number'], user.get('username'), user.get('nickname', ''), user['usd'], user['btc'], json.dumps(extra))
+        )
+
+    def _put_order(self, order_id, order):
+        self.db.execute(
+            f"INSERT OR REPLACE INTO orders (order_id, {', '.join(self.ORDER_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (order_id, *(order[column] for column in self.ORDER_COLUMNS))
+        )
+
+    def _put_alert(self, alert_id, alert):
+        self.db.execute(
+            f"INSERT OR REPLACE INTO alerts (alert_id, {', '.join(self.ALERT_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+            (alert_id, *(alert[column] for column in self.ALERT_COLUMNS))
+        )
+
+    def append(self, record):
+        """Apply one journal record to the tables inside the open transaction."""
+        op = record['op']
+        if op == 'register':
+            self._put_user(record['user_id'], record['user'])
+        elif op == 'trade':
+            self.db.execute("UPDATE users SET usd = ?, btc = ?, extra = json_set(extra, '$.stats', json(?)) WHERE user_id = ?",
+                            (record['usd'], record['btc'], json.dumps(record['stats']), record['user_id']))
+        elif op == 'order_create':
+            self._put_order(record['order_id'], record['order'])
+        elif op in ('order_cancel', 'order_fill', 'order_skip'):
+            self.db.executemany("DELETE FROM orders WHERE order_id = ?", [(order_id,) for order_id in record['order_ids']])
+        elif op == 'alert_create':
+            self._put_alert(record['alert_id'], record['alert'])
+        elif op in ('alert_cancel', 'alert_fire'):
+            self.db.executemany("DELETE FROM alerts WHERE alert_id = ?", [(alert_id,) for alert_id in record['alert_ids']])
+        elif op == 'winner':
+            self._set_meta('winner_id', record['winner_id'])
+            self._set_meta('winner_announced', record['winner_announced'])
+        elif op == 'broadcast_create':
+            self.db.execute("INSERT OR REPLACE INTO broadcasts (broadcast_id, data) VALUES (?, ?)",
+                            (record['broadcast_id'], json.dumps(record['broadcast'])))
+        elif op == 'broadcast_progress':
+            self.db.execute(
+                "UPDATE broadcasts SET data = json_set(data, '$.cursor', ?, '$.sent', ?, '$.failed', ?) WHERE broadcast_id = ?",
+                (record['cursor'], record['sent'], record['failed'], record['broadcast_id'])
+            )
+        elif op == 'broadcast_done':
+            self.db.execute("DELETE FROM broadcasts WHERE broadcast_id = ?", (record['broadcast_id'],))
+        elif op == 'chat_blocked':
+            self.db.execute("INSERT OR IGNORE INTO blocked_chats (chat_id) VALUES (?)", (record['chat_id'],))
+        elif op == 'chat_unblocked':
+            self.db.execute("DELETE FROM blocked_chats WHERE chat_id = ?", (record['chat_id'],))
+        elif op == 'price':
+            self._set_meta('price_data', {'last_price': record['last_price'], 'last_price_time': record['last_price_time']})
+        else:
+            logger.warning(f"Unknown journal op: {op}")
+        self.dirty = True
+        return 0
+
+    def flush(self):
+        if self.dirty:
+            self.db.commit()
+            self.dirty = False
+
+    def snapshot(self, data):
+        """Tables are always current; commit and fold the WAL back into the database file."""
+        self._set_meta('journal_seq', data['journal_seq'])
+        self._set_meta('price_data', data['price_data'])
+        self.db.commit()
+        self.dirty = False
+        self.db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return os.path.getsize(self.path)
+
+    def import_state(self, data):
+        """Bulk-insert a full state dict (the JSON snapshot layout) in one transaction."""
+        for user_id, user in data['users'].items():
+            self._put_user(user_id, user)
+        for order_id, order in data['limit_orders'].items():
+            self._put_order(order_id, order)
+        for alert_id, alert in data['alerts'].items():
+            self._put_alert(alert_id, alert)
+        for broadcast_id, broadcast in data['broadcasts'].items():
+            self.append({'op': 'broadcast_create', 'broadcast_id': broadcast_id, 'broadcast': broadcast})
+        self.db.executemany("INSERT OR IGNORE INTO blocked_chats (chat_id) VALUES (?)",
+                            [(chat_id,) for chat_id in data.get('blocked_chats', [])])
+        self.append({'op': 'winner', 'winner_id': data['winner_id'], 'winner_announced': data['winner_announced']})
+        self.snapshot(data)
+
+    def close(self):
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
+
+
+STORAGE = SQLiteStorage(SQLITE_FILE) if STORAGE_BACKEND == 'sqlite' else JsonStorage(DATA_FILE, JOURNAL_FILE)
+
+
+# --- Trade Store ---
+class TradeStore:
+    """Per-user trade history in fixed-size binary records, read by page and cached as typed columns."""
+
+    RECORD = struct.Struct('<B5d')  # side, btc, usd, price, fee (USD), timestamp (epoch seconds)
+    SIDES = ('buy', 'sell')
+    COLUMNS = ('side', 'btc', 'usd', 'price', 'fee', 'timestamp')
+
+    def __init__(self, directory, cache_size):
+        self.directory = directory
+        self.cache_size = cache_size
+        self._columns = OrderedDict()  # user_id -> {column: array}, least recently used first
+
+    def _path(self, user_id):
+        return os.path.join(self.directory, f"{user_id}.bin")
+
+    def append(self, user_id, side, btc, usd, price, fee, timestamp):
+        self.extend(user_id, [(side, btc, usd, price, fee, timestamp)])
+
+    def extend(self, user_id, rows):
+        """Append several (side, btc, usd, price, fee, timestamp) rows with one write."""
+        rows = [(self.SIDES.index(side), *values) for side, *values in rows]
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(user_id), 'ab') as f:
+            f.write(b''.join(self.RECORD.pack(*row) for row in rows))
+        self._cache_rows(user_id, rows)
+
+    def _cache_rows(self, user_id, rows):
+        """Keep a cached column set in step with rows (side code first) just written."""
+        columns = self._columns.get(user_id)
+        if columns is not None:
+            for row in rows:
+                for name, value in zip(self.COLUMNS, row):
+                    columns[name].append(value)
+
+    def replace(self, user_id, rows):
+        """Overwrite a user's history with (side, btc, usd, price, fee, timestamp) rows."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(user_id), 'wb') as f:
+            for side, *values in rows:
+                f.write(self.RECORD.pack(self.SIDES.index(side), *values))
+        self._columns.pop(user_id, None)
+
+    def count(self, user_id):
+        try:
+            return os.path.getsize(self._path(user_id)) // self.RECORD.size
+        except FileNotFoundError:
+            return 0
+
+    def window(self, user_id, size, before=None, after=None):
+        """Up to `size` trades, oldest first: the newest, those just before key `before`, or just after `after`.
+
+        Returns (trades, first key, last key). Keys are short strings for paging callbacks;
+        here they are record indexes, so a page is one seek.
+        """
+        if before is not None:
+            end = int(before)
+            start = max(0, end - size)
+        elif after is not None:
+            start = int(after) + 1
+            end = start + size
+        else:
+            end = self.count(user_id)
+            start = max(0, end - size)
+
+        try:
+            with open(self._path(user_id), 'rb') as f:
+                f.seek(start * self.RECORD.size)
+                data = f.read((end - start) * self.RECORD.size)
+        except FileNotFoundError:
+            return [], None, None
+
+        data = data[:len(data) - len(data) % self.RECORD.size]  # ignore a torn trailing record
+        trades = [
+            {'type': self.SIDES[side], 'btc': btc, 'usd': usd, 'price': price, 'fee': fee, 'timestamp': timestamp}
+            for side, btc, usd, price, fee, timestamp in self.RECORD.iter_unpack(data)
+        ]
+        if not trades:
+            return [], None, None
+        return trades, str(start), str(start + len(trades) - 1)
+
+    def columns(self, user_id):
+        """Load a user's full history as typed arrays, caching the most recently used users."""
+        columns = self._columns.pop(user_id, None)
+        if columns is None:
+            columns = {name: array('B' if name == 'side' else 'd') for name in self.COLUMNS}
+            for row in self._rows(user_id):
+                for name, value in zip(self.COLUMNS, row):
+                    columns[name].append(value)
+
+        self._columns[user_id] = columns
+        while len(self._columns) > self.cache_size:
+            self._columns.popitem(last=False)
+        return columns
+
+    def _rows(self, user_id):
+        """All of a user's rows, side code first, oldest first."""
+        try:
+            with open(self._path(user_id), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+        data = data[:len(data) - len(data) % self.RECORD.size]
+        return self.RECORD.iter_unpack(data)
+
+
+class SQLiteTradeStore(TradeStore):
+    """Trade history in the SQLite `trades` table, written inside the storage's open transaction."""
+
+    def __init__(self, storage, cache_size):
+        super().__init__(None, cache_size)
+        self.storage = storage
+
+    def extend(self, user_id, rows):
+        rows = [(self.SIDES.index(side), *values) for side, *values in rows]
+        self.storage.db.executemany(
+            "INSERT INTO trades (user_id, side, btc, usd, price, fee, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(user_id, *row) for row in rows]
+        )
+        self.storage.dirty = True
+        self._cache_rows(user_id, rows)
+
+    def replace(self, user_id, rows):
+        self.storage.db.execute("DELETE FROM trades WHERE user_id = ?", (user_id,))
+        self._columns.pop(user_id, None)
+        self.extend(user_id, rows)
+
+    def count(self, user_id):
+        return self.storage.db.execute("SELECT COUNT(*) FROM trades WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def window(self, user_id, size, before=None, after=None):
+        """Keyset paging on (timestamp, id): a page reads only its own rows from the trades_user_time index."""
+        columns = "SELECT side, btc, usd, price, fee, timestamp, id FROM trades WHERE user_id = ?"
+        if after is not None:
+            timestamp, row_id = after.split(':')
+            rows = self.storage.db.execute(
+                f"{columns} AND (timestamp, id) > (?, ?) ORDER BY timestamp, id LIMIT ?",
+                (user_id, float(timestamp), int(row_id), size)
+            ).fetchall()
+        else:
+            key, params = "", ()
+            if before is not None:
+                timestamp, row_id = before.split(':')
+                key, params = " AND (timestamp, id) < (?, ?)", (float(timestamp), int(row_id))
+            rows = self.storage.db.execute(
+                f"{columns}{key} ORDER BY timestamp DESC, id DESC LIMIT ?", (user_id, *params, size)
+            ).fetchall()[::-1]
+
+        if not rows:
+            return [], None, None
+        trades = [
+            {'type': self.SIDES[side], 'btc': btc, 'usd': usd, 'price': price, 'fee': fee, 'timestamp': timestamp}
+            for side, btc, usd, price, fee, timestamp, _ in rows
+        ]
+        return trades, f"{rows[0][5]!r}:{rows[0][6]}", f"{rows[-1][5]!r}:{rows[-1][6]}"
+
+    def _rows(self, user_id):
+        return self.storage.db.execute(
+            "SELECT side, btc, usd, price, fee, timestamp FROM trades WHERE user_id = ? ORDER BY timestamp, id",
+            (user_id,)
+        )
+
+
+TRADE_STORE = (SQLiteTradeStore(STORAGE, TRADE_CACHE_SIZE) if STORAGE_BACKEND == 'sqlite'
+               else TradeStore(TRADES_DIR, TRADE_CACHE_SIZE))
+
+
+class CandleArchive:
+    """1-minute OHLCV candles in a fixed-record file, one slot per minute, read back as a memory map.
+
+    Slot i holds the minute `base + i`; a slot whose time is 0 is a gap. The open candle is
+    kept in memory and written when its minute closes, every flush_interval seconds, or on
+    flush(), so readers see a price at most that old. Candles built from ticks
+    have NaN volume (the ticker carries none) and are replaced by the exchange's candle once
+    the minute has closed.
+    """
+
+    MAGIC = b'GKCNDL01'
+    HEADER = struct.Struct('<8sq')  # magic, base minute (epoch minutes)
+    DTYPE = np.dtype([('time', '<i8'), ('open', '<f8'), ('high', '<f8'),
+                      ('low', '<f8'), ('close', '<f8'), ('volume', '<f8')])
+
+    def __init__(self, path, history_minutes, flush_interval):
+        self.path = path
+        self.history_minutes = history_minutes
+        self.flush_interval = flush_interval
+        self._fd = None
+        self.base = None
+        self._open = None  # [minute, open, high, low, close] of the candle being built from ticks
+        self._dirty = False  # the open candle has ticks the file doesn't
+        self._flushed_at = 0.0
+
+    def _ensure_open(self):
+        if self._fd is not None:
+            return
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        header = os.pread(self._fd, self.HEADER.size, 0)
+        if len(header) == self.HEADER.size and header[:8] == self.MAGIC:
+            self.base = self.HEADER.unpack(header)[1]
+        else:
+            self.base = int(time.time() // 60) - self.history_minutes
+            os.ftruncate(self._fd, 0)
+            os.pwrite(self._fd, self.HEADER.pack(self.MAGIC, self.base), 0)
+
+    def _write(self, minute, open_, high, low, close, volume):
+        self._ensure_open()
+        slot = minute - self.base
+        if slot < 0:
+            return
+        record = np.array([(minute * 60, open_, high, low, close, volume)], dtype=self.DTYPE)
+        os.pwrite(self._fd, record.tobytes(), self.HEADER.size + slot * self.DTYPE.itemsize)
+
+    def _has_exchange_candle(self, minute):
+        self._ensure_open()
+        slot = minute - self.base
+        if slot < 0:
+            return False
+        data = os.pread(self._fd, self.DTYPE.itemsize, self.HEADER.size + slot * self.DTYPE.itemsize)
+        if len(data) < self.DTYPE.itemsize:
+            return False
+        record = np.frombuffer(data, dtype=self.DTYPE)[0]
+        return record['time'] == minute * 60 and record['volume'] > 0
+
+    def record_tick(self, price, timestamp=None):
+        """Fold a live price into the current minute's candle, writing it out only when due."""
+        now = timestamp or time.time()
+        minute = int(now // 60)
+        candle = self._open
+        if candle is None or candle[0] != minute:
+            self.flush(now)  # the closed minute's final ticks
+            candle = self._open = [minute, price, price, price, price]
+            self._flushed_at = 0.0  # a new minute is written straight away
+        else:
+            candle[2] = max(candle[2], price)
+            candle[3] = min(candle[3], price)
+            candle[4] = price
+        self._dirty = True
+        if now - self._flushed_at >= self.flush_interval:
+            self.flush(now)
+
+    def flush(self, now=None):
+        """Write the open candle if it has ticks the archive doesn't."""
+        # A minute that closed without further ticks may have been backfilled meanwhile; keep the exchange's
+        if self._dirty and not self._has_exchange_candle(self._open[0]):
+            self._write(*self._open, math.nan)
+        self._dirty = False
+        self._flushed_at = now or time.time()
+
+    def store(self, ohlcv):
+        """Write exchange candles given as [ms timestamp, open, high, low, close, volume] rows."""
+        for timestamp_ms, open_, high, low, close, volume in ohlcv:
+            self._write(int(timestamp_ms // 60000), open_, high, low, close, volume)
+
+    def view(self, start_minute, end_minute):
+        """Zero-copy records for minutes [start_minute, end_minute); missing tail slots are not returned."""
+        self._ensure_open()
+        count = (os.fstat(self._fd).st_size - self.HEADER.size) // self.DTYPE.itemsize
+        first = max(start_minute - self.base, 0)
+        last = min(end_minute - self.base, count)
+        if last <= first:
+            return np.zeros(0, dtype=self.DTYPE)
+        records = np.memmap(self.path, dtype=self.DTYPE, mode='r', offset=self.HEADER.size, shape=(count,))
+        return records[first:last]
+
+    def gaps(self, start_minute, end_minute):
+        """Return (first, last) minute ranges inside [start_minute, end_minute) with no exchange candle."""
+        self._ensure_open()
+        start_minute = max(start_minute, self.base)
+        if end_minute <= start_minute:
+            return []
+        missing = np.ones(end_minute - start_minute, dtype=bool)
+        records = self.view(start_minute, end_minute)
+        # NaN volume is a tick-built minute; 0.0 is one from archives written before that was marked
+        missing[:len(records)] = (records['time'] == 0) | ~(records['volume'] > 0)
+
+        # Runs of consecutive missing minutes
+        edges = np.flatnonzero(np.diff(np.r_[0, missing.astype(np.int8), 0]))
+        return [(start_minute + a, start_minute + b - 1) for a, b in zip(edges[::2], edges[1::2])]
+
+    def frame(self, start_minute, end_minute, timeframe):
+        """Candles for the window resampled to a pandas timeframe such as '1h', indexed by UTC time."""
+        records = self.view(start_minute, end_minute)
+        import pandas as pd
+
+        records = records[records['time'] != 0]
+        df = pd.DataFrame({
+            'Open': records['open'], 'High': records['high'], 'Low': records['low'],
+            'Close': records['close'], 'Volume': records['volume'],
+        }, index=pd.to_datetime(records['time'], unit='s', utc=True))
+        return df.resample(timeframe).agg({
+            'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum',
+        }).dropna()
+
+
+CANDLE_ARCHIVE = CandleArchive(CANDLES_FILE, CANDLE_HISTORY_MINUTES, CANDLE_FLUSH_INTERVAL)
+
+
+def migrate_trade_history():
+    """Move legacy per-user `trades` lists out of the snapshot and into the trade store."""
+    migrated = 0
+    for user_id, user in USERS.items():
+        trades = user.extra.pop('trades', None) if user.extra else None
+        if trades is None:
+            continue
+
+        rows = []
+        for trade in trades:
+            fee_rate = trade.get('fee_pct', TRADE_FEE * 100) / 100
+            if trade['type'] == 'buy':
+                fee = trade['usd'] * fee_rate
+            else:
+                fee = trade['usd'] / (1 - fee_rate) - trade['usd']  # sells record net USD
+            rows.append((trade['type'], trade['btc'], trade['usd'], trade['price'], fee,
+                         datetime.fromisoformat(trade['timestamp']).timestamp()))
+
+        # The snapshot still holds the list until it's rewritten, so rewriting the file keeps this idempotent
+        TRADE_STORE.replace(user_id, rows)
+        migrated += 1
+
+    if migrated:
+        logger.info(f"Migrated trade history of {migrated} users to {TRADES_DIR}/")
+
+
+# --- Order Trigger Index ---
+class OrderTriggerIndex:
+    """Open orders kept price-sorted per type, so a tick only touches orders whose trigger was crossed."""
+
+    TRIGGER_ON_FALL = ('buy', 'stopsell')  # execute when price <= order price
+    TRIGGER_ON_RISE = ('sell', 'stopbuy')  # execute when price >= order price
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # Parallel lists per type: sort keys (price, created_at, order_id) and their prices for bisecting
+        self._keys = {t: [] for t in self.TRIGGER_ON_FALL + self.TRIGGER_ON_RISE}
+        self._prices = {t: [] for t in self._keys}
+
+    def rebuild(self, orders):
+        self.clear()
+        for order_id, order in orders.items():
+            self._keys[order['type']].append((order['price'], order['created_at'], order_id))
+        for order_type, keys in self._keys.items():
+            keys.sort()
+            self._prices[order_type] = [key[0] for key in keys]
+
+    def add(self, order_id, order):
+        key = (order['price'], order['created_at'], order_id)
+        keys = self._keys[order['type']]
+        i = bisect.bisect_left(keys, key)
+        keys.insert(i, key)
+        self._prices[order['type']].insert(i, order['price'])
+
+    def remove(self, order_id, order):
+        key = (order['price'], order['created_at'], order_id)
+        keys = self._keys[order['type']]
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
+            del self._prices[order['type']][i]
+
+    def triggered(self, low, high=None):
+        """Return the ids of orders touched while the price ranged over [low, high], oldest first."""
+        if high is None:
+            high = low
+        hits = []
+        for order_type in self.TRIGGER_ON_FALL:
+            i = bisect.bisect_left(self._prices[order_type], low)
+            hits.extend(self._keys[order_type][i:])
+        for order_type in self.TRIGGER_ON_RISE:
+            i = bisect.bisect_right(self._prices[order_type], high)
+            hits.extend(self._keys[order_type][:i])
+
+        hits.sort(key=lambda key: key[1])
+        return [order_id for _, _, order_id in hits]
+
+    def __len__(self):
+        return sum(len(keys) for keys in self._keys.values())
+
+
+class VectorOrderBook:
+    """Open orders as NumPy columns in creation order, so a tick finds every triggered order in one pass."""
+
+    TYPE_CODES = {'buy': 0, 'stopsell': 1, 'sell': 2, 'stopbuy': 3}  # codes below 2 trigger on a fall
+    MIN_CAPACITY = 1024
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._size = 0  # slots in use, removed ones included until the next compaction
+        self._live = 0
+        self.kind = np.zeros(self.MIN_CAPACITY, dtype=np.int8)
+        self.price = np.zeros(self.MIN_CAPACITY)
+        self.amount = np.zeros(self.MIN_CAPACITY)
+        self.usd_amount = np.zeros(self.MIN_CAPACITY)
+        self.user = np.zeros(self.MIN_CAPACITY, dtype=np.int32)
+        self.created = np.zeros(self.MIN_CAPACITY)
+        self.alive = np.zeros(self.MIN_CAPACITY, dtype=bool)
+        self.order_ids = []  # slot -> order id, None once removed
+        self._slots = {}  # order id -> slot
+        self.user_ids = []  # user index -> user id
+        self._user_index = {}
+
+    def _column_names(self):
+        return ('kind', 'price', 'amount', 'usd_amount', 'user', 'created', 'alive')
+
+    def _resize(self, capacity):
+        for name in self._column_names():
+            column = getattr(self, name)
+            resized = np.zeros(capacity, dtype=column.dtype)
+            resized[:self._size] = column[:self._size]
+            setattr(self, name, resized)
+
+    def _compact(self):
+        keep = np.flatnonzero(self.alive[:self._size])
+        for name in self._column_names():
+            column = getattr(self, name)
+            column[:len(keep)] = column[keep]
+        self.alive[len(keep):self._size] = False
+        self.order_ids = [self.order_ids[slot] for slot in keep]
+        self._slots = {order_id: slot for slot, order_id in enumerate(self.order_ids)}
+        self._size = len(keep)
+
+    def rebuild(self, orders):
+        self.clear()
+        for order_id, order in sorted(orders.items(), key=lambda item: item[1]['created_at']):
+            self.add(order_id, order)
+
+    def add(self, order_id, order):
+        if self._size == len(self.kind):
+            self._resize(2 * len(self.kind))
+
+        user_index = self._user_index.get(order['user_id'])
+        if user_index is None:
+            user_index = self._user_index[order['user_id']] = len(self.user_ids)
+            self.user_ids.append(order['user_id'])
+
+        slot = self._size
+        self.kind[slot] = self.TYPE_CODES[order['type']]
+        self.price[slot] = order['price']
+        self.amount[slot] = order['amount']
+        self.usd_amount[slot] = order['usd_amount']
+        self.user[slot] = user_index
+        self.created[slot] = datetime.fromisoformat(order['created_at']).timestamp()
+        self.alive[slot] = True
+        self.order_ids.append(order_id)
+        self._slots[order_id] = slot
+        self._size += 1
+        self._live += 1
+
+    def remove(self, order_id, order):
+        slot = self._slots.pop(order_id, None)
+        if slot is None:
+            return
+        self.alive[slot] = False
+        self.order_ids[slot] = None
+        self._live -= 1
+        if self._size - self._live > max(self._live, self.MIN_CAPACITY):
+            self._compact()
+
+    def triggered_slots(self, low, high, current_price=None, interval_start=None):
+        """Slots of orders touched while the price ranged over [low, high], oldest first.
+
+        Orders created after interval_start only count if the current price crosses them.
+        """
+        kind = self.kind[:self._size]
+        price = self.price[:self._size]
+        on_fall = kind < 2
+        mask = self.alive[:self._size] & np.where(on_fall, price >= low, price <= high)
+        if interval_start is not None:
+            crossed_now = np.where(on_fall, price >= current_price, price <= current_price)
+            mask &= (self.created[:self._size] <= interval_start) | crossed_now
+        return np.flatnonzero(mask)
+
+    def triggered(self, low, high=None):
+        if high is None:
+            high = low
+        return [self.order_ids[slot] for slot in self.triggered_slots(low, high)]
+
+    def __len__(self):
+        return self._live
+
+
+ORDER_INDEX = VectorOrderBook() if ORDER_MATCHING == 'vector' else OrderTriggerIndex()
+
+
+class UserOrderIndex:
+    """Each user's open order ids plus running reserved USD/BTC totals."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._order_ids = {}  # user_id -> {order_id: None}, kept in creation order
+        self._reserved_usd = {}
+        self._reserved_btc = {}
+
+    def rebuild(self, orders):
+        self.clear()
+        for order_id, order in sorted(orders.items(), key=lambda item: item[1]['created_at']):
+            self.add(order_id, order)
+
+    def add(self, order_id, order):
+        user_id = order['user_id']
+        self._order_ids.setdefault(user_id, {})[order_id] = None
+        if order['type'] in ('buy', 'stopbuy'):
+            self._reserved_usd[user_id] = self._reserved_usd.get(user_id, 0.0) + order['usd_amount']
+        else:
+            self._reserved_btc[user_id] = self._reserved_btc.get(user_id, 0.0) + order['amount']
+
+    def remove(self, order_id, order):
+        user_id = order['user_id']
+        order_ids = self._order_ids.get(user_id, {})
+        if order_id not in order_ids:
+            return
+        del order_ids[order_id]
+
+        if order['type'] in ('buy', 'stopbuy'):
+            self._reserved_usd[user_id] -= order['usd_amount']
+        else:
+            self._reserved_btc[user_id] -= order['amount']
+
+        if not order_ids:
+            # Drop the entry entirely so float residue from the running totals can't accumulate
+            del self._order_ids[user_id]
+            self._reserved_usd.pop(user_id, None)
+            self._reserved_btc.pop(user_id, None)
+
+    def order_ids(self, user_id):
+        return list(self._order_ids.get(user_id, ()))
+
+    def reserved_usd(self, user_id):
+        return max(self._reserved_usd.get(user_id, 0.0), 0.0)
+
+    def reserved_btc(self, user_id):
+        return max(self._reserved_btc.get(user_id, 0.0), 0.0)
+
+
+USER_ORDER_INDEX = UserOrderIndex()
 
-    return wrapper
+
+class PriceAlertIndex:
+    """Price alerts kept price-sorted per direction, plus each user's alert ids.
+
+    An alert stays stored only while the price hasn't reached it, so the alerts a new price
+    crossed are always one end of their list: a tick costs a bisect plus the alerts it fires.
+    """
+
+    DIRECTIONS = ('above', 'below')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # Parallel lists per direction: sort keys (price, created_at, alert_id) and their prices for bisecting
+        self._keys = {d: [] for d in self.DIRECTIONS}
+        self._prices = {d: [] for d in self.DIRECTIONS}
+        self._alert_ids = {}  # user_id -> {alert_id: None}, kept in creation order
+
+    def rebuild(self, alerts):
+        self.clear()
+        for alert_id, alert in sorted(alerts.items(), key=lambda item: item[1]['created_at']):
+            self._keys[alert['direction']].append((alert['price'], alert['created_at'], alert_id))
+            self._alert_ids.setdefault(alert['user_id'], {})[alert_id] = None
+        for direction, keys in self._keys.items():
+            keys.sort()
+            self._prices[direction] = [key[0] for key in keys]
+
+    def add(self, alert_id, alert):
+        key = (alert['price'], alert['created_at'], alert_id)
+        keys = self._keys[alert['direction']]
+        i = bisect.bisect_left(keys, key)
+        keys.insert(i, key)
+        self._prices[alert['direction']].insert(i, alert['price'])
+        self._alert_ids.setdefault(alert['user_id'], {})[alert_id] = None
+
+    def remove(self, alert_id, alert):
+        key = (alert['price'], alert['created_at'], alert_id)
+        keys = self._keys[alert['direction']]
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
+            del self._prices[alert['direction']][i]
+
+        alert_ids = self._alert_ids.get(alert['user_id'], {})
+        alert_ids.pop(alert_id, None)
+        if not alert_ids:
+            self._alert_ids.pop(alert['user_id'], None)
+
+    def crossed(self, price):
+        """Return the ids of alerts the price has reached: 'above' levels <= price and 'below' levels >= price."""
+        i = bisect.bisect_right(self._prices['above'], price)
+        j = bisect.bisect_left(self._prices['below'], price)
+        return [key[2] for key in self._keys['above'][:i]] + [key[2] for key in self._keys['below'][j:]]
+
+    def alert_ids(self, user_id):
+        return list(self._alert_ids.get(user_id, ()))
+
+    def __len__(self):
+        return sum(len(keys) for keys in self._keys.values())
+
+
+ALERT_INDEX = PriceAlertIndex()
 
 def load_data():
-    global USERS, _last_price, _last_price_time, LIMIT_ORDERS, WINNER_ID, WINNER_ANNOUNCED
+    """Load the latest snapshot and replay the journal written since it."""
+    global USERS, _last_price, _last_price_time, LIMIT_ORDERS, ALERTS, WINNER_ID, WINNER_ANNOUNCED, BROADCASTS, BLOCKED_CHATS, _journal_seq
+
+    USERS = {}
+    _last_price = None
+    _last_price_time = 0
+    LIMIT_ORDERS = {}
+    ALERTS = {}
+    WINNER_ID = None
+    WINNER_ANNOUNCED = False
+    BROADCASTS = {}
+    BLOCKED_CHATS = set()
+    _journal_seq = 0
+
+    data, records = STORAGE.load()
+    if data:
+        USERS = {user_id: Account.from_dict(user) for user_id, user in data.get('users', {}).items()}
+        _last_price = data.get('price_data', {}).get('last_price', None)
+        _last_price_time = data.get('price_data', {}).get('last_price_time', 0)
+        LIMIT_ORDERS = data.get('limit_orders', {})
+        ALERTS = data.get('alerts', {})
+        WINNER_ID = data.get('winner_id', None)
+        WINNER_ANNOUNCED = data.get('winner_announced', False)
+        BROADCASTS = data.get('broadcasts', {})
+        BLOCKED_CHATS = set(data.get('blocked_chats', []))
+        _journal_seq = data.get('journal_seq', 0)
+
+        logger.info(f"Snapshot loaded: {len(USERS)} users, {len(LIMIT_ORDERS)} open orders (seq {_journal_seq})")
+
+    replayed = replay_journal(records)
+    if replayed:
+        logger.info(f"Replayed {replayed} journal records (seq {_journal_seq})")
+
+    migrate_trade_history()
+    rebuild_trade_stats()
+    ORDER_INDEX.rebuild(LIMIT_ORDERS)
+    USER_ORDER_INDEX.rebuild(LIMIT_ORDERS)
+    ALERT_INDEX.rebuild(ALERTS)
+    CONTEST.rebuild()
+
+    # Fold the replayed tail into a fresh snapshot so the journal starts empty
+    save_data()
+    return USERS, _last_price, _last_price_time
+
+
+def replay_journal(records):
+    """Apply the journal records newer than the loaded snapshot."""
+    global _journal_seq
+
+    replayed = 0
+    for record in records:
+        try:
+            apply_journal_record(record)
+        except Exception as e:
+            logger.error(f"Error replaying journal record {record.get('seq')}: {e}")
+        _journal_seq = record['seq']
+        replayed += 1
+
+    return replayed
+
+
+def apply_journal_record(record):
+    """Re-apply a single mutation to the in-memory state."""
+    global _last_price, _last_price_time, WINNER_ID, WINNER_ANNOUNCED
+
+    op = record['op']
+
+    if op == 'register':
+        USERS[record['user_id']] = Account.from_dict(record['user'])
+
+    elif op == 'trade':
+        # The trade itself lives in the trade store; older journals also carry it for the legacy list
+        user = USERS[record['user_id']]
+        user.usd_micros = to_micros(record['usd'])
+        user.sats = to_sats(record['btc'])
+        # Records from before trade stats get them rebuilt from the trade store after loading
+        user.stats = TradeStats.from_dict(record['stats']) if 'stats' in record else None
+        if 'trade' in record and user.extra and 'trades' in user.extra:
+            user.extra['trades'].append(record['trade'])
+
+    elif op == 'order_create':
+        LIMIT_ORDERS[record['order_id']] = record['order']
+
+    elif op in ('order_cancel', 'order_fill', 'order_skip'):
+        for order_id in record['order_ids']:
+            LIMIT_ORDERS.pop(order_id, None)
+
+    elif op == 'alert_create':
+        ALERTS[record['alert_id']] = record['alert']
+
+    elif op in ('alert_cancel', 'alert_fire'):
+        for alert_id in record['alert_ids']:
+            ALERTS.pop(alert_id, None)
+
+    elif op == 'winner':
+        WINNER_ID = record['winner_id']
+        WINNER_ANNOUNCED = record['winner_announced']
+
+    elif op == 'broadcast_create':
+        BROADCASTS[record['broadcast_id']] = record['broadcast']
+
+    elif op == 'broadcast_progress':
+        BROADCASTS[record['broadcast_id']].update(cursor=record['cursor'], sent=record['sent'], failed=record['failed'])
+
+    elif op == 'broadcast_done':
+        BROADCASTS.pop(record['broadcast_id'], None)
+
+    elif op == 'chat_blocked':
+        BLOCKED_CHATS.add(record['chat_id'])
+
+    elif op == 'chat_unblocked':
+        BLOCKED_CHATS.discard(record['chat_id'])
+
+    elif op == 'price':
+        _last_price = record['last_price']
+        _last_price_time = record['last_price_time']
+
+    else:
+        logger.warning(f"Unknown journal op: {op}")
+
+
+def journal_append(op, **fields):
+    """Append one mutation record to the journal. Cost is independent of total state size."""
+    global _journal_seq, _journal_pending
+
+    _journal_seq += 1
+    record = {'seq': _journal_seq, 'op': op, **fields}
 
     try:
-        if os.path.exists(DATA_FILE) and os.path.getsize(DATA_FILE) > 0:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                logger.info(f"Data loaded successfully: {data}")
-
-                USERS = data.get('users', {})
-                _last_price = data.get('price_data', {}).get('last_price', None)
-                _last_price_time = data.get('price_data', {}).get('last_price_time', 0)
-                LIMIT_ORDERS = data.get('limit_orders', {})
-                WINNER_ID = data.get('winner_id', None)
-                WINNER_ANNOUNCED = data.get('winner_announced', False)
-
-                logger.info(f"Loaded USERS: {USERS}")
-        else:
-            logger.warning(f"Data file {DATA_FILE} is empty or doesn't exist. Initializing new data.")
-            USERS = {}
-            _last_price = None
-            _last_price_time = 0
-            LIMIT_ORDERS = {}
-            WINNER_ID = None
-            WINNER_ANNOUNCED = False
-            save_data()
-            logger.info("Initialized new data file with empty structure.")
-
-        return USERS, _last_price, _last_price_time
-
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        logger.error(f"Error loading data: {e}")
-        USERS = {}
-        _last_price = None
-        _last_price_time = 0
-        LIMIT_ORDERS = {}
-        WINNER_ID = None
-        WINNER_ANNOUNCED = False
-        save_data()
-        logger.info("Initialized new data file with empty structure.")
-        return USERS, _last_price, _last_price_time
+        size = STORAGE.append(record)
+        if not _journal_batch_depth:
+            STORAGE.flush()
+        _journal_pending += 1
+        METRICS.inc('journal_records_total', op=op)
+        METRICS.inc('journal_bytes_total', size)
+    except Exception as e:
+        logger.error(f"Error writing journal record {op}: {e}")
+
+
+@contextmanager
+def journal_batch():
+    """Group journal appends so they reach storage with a single flush (one commit on SQLite)."""
+    global _journal_batch_depth
+    _journal_batch_depth += 1
+    try:
+        yield
+    finally:
+        _journal_batch_depth -= 1
+        if not _journal_batch_depth:
+            STORAGE.flush()
+
+
+def current_state():
+    """The full persistent state in the snapshot layout."""
+    return {
+        'users': {user_id: user.to_dict() for user_id, user in USERS.items()},
+        'winner_id': WINNER_ID,
+        'winner_announced': WINNER_ANNOUNCED,
+        'price_data': {
+            'last_price': _last_price,
+            'last_price_time': _last_price_time
+        },
+        'limit_orders': LIMIT_ORDERS,
+        'alerts': ALERTS,
+        'broadcasts': BROADCASTS,
+        'blocked_chats': sorted(BLOCKED_CHATS),
+        'journal_seq': _journal_seq
+    }
+
+
+def snapshot_state():
+    """What STORAGE.snapshot reads: the full state for JSON, only the journal and price marks for SQLite."""
+    if isinstance(STORAGE, JsonStorage):
+        return current_state()
+    # The SQLite tables are already current; building every user's dict would be wasted work
+    return {
+        'price_data': {
+            'last_price': _last_price,
+            'last_price_time': _last_price_time
+        },
+        'journal_seq': _journal_seq
+    }
 
 
 def save_data():
+    """Write a full snapshot and truncate the journal it now covers."""
+    global _journal_pending
+
+    start = time.perf_counter()
+    try:
+        size = STORAGE.snapshot(snapshot_state())
+        METRICS.observe('snapshot_seconds', time.perf_counter() - start)
+        METRICS.set('snapshot_bytes', size)
+        _journal_pending = 0
+
+        logger.info(f"Snapshot saved: {size} bytes (seq {_journal_seq})")
+    except Exception as e:
+        logger.error(f"Error saving data: {e}")
+
+
+def migrate_to_sqlite(path=SQLITE_FILE):
+    """One-shot copy of the loaded JSON state and trade files into a new SQLite database."""
+    if STORAGE_BACKEND != 'json':
+        logger.error("Migration reads the JSON backend; unset STORAGE_BACKEND and try again.")
+        return False
+    if os.path.exists(path):
+        logger.error(f"{path} already exists; refusing to migrate over it.")
+        return False
+
+    storage = SQLiteStorage(path)
+    storage.open()
+    trades = SQLiteTradeStore(storage, 0)
+    storage.import_state(current_state())
+    for user_id in USERS:
+        trades.extend(user_id, [(TradeStore.SIDES[side], *values) for side, *values in TRADE_STORE._rows(user_id)])
+    storage.close()
+    logger.info(f"Migrated {len(USERS)} users and {len(LIMIT_ORDERS)} open orders to {path}; "
+                f"start the bot with STORAGE_BACKEND=sqlite to use it.")
+    return True
+
+
+async def save_data_async():
+    """Like save_data, but the JSON snapshot is written in the I/O pool while the bot keeps trading."""
+    global _journal_pending
+
+    if not isinstance(STORAGE, JsonStorage):
+        # SQLite snapshots are a commit and a checkpoint; cheap enough to run in place
+        async with SNAPSHOT_LOCK, ENGINE_LOCK:
+            save_data()
+        return
+
+    start = time.perf_counter()
     try:
-        with open(DATA_FILE, 'w') as f:
-            data = {
-                'users': USERS,
-                'winner_id': WINNER_ID,
-                'winner_announced': WINNER_ANNOUNCED,
-                'price_data': {
-                    'last_price': _last_price,
-                    'last_price_time': _last_price_time
-                },
-                'limit_orders': LIMIT_ORDERS
-            }
-            json.dump(data, f)
-            logger.info(f"Data saved successfully: {data}")
+        # Trading continues during the write; only another snapshot has to wait for it
+        async with SNAPSHOT_LOCK:
+            async with ENGINE_LOCK:
+                payload, covered = STORAGE.begin_snapshot(current_state())
+                pending, seq = _journal_pending, _journal_seq
+            staged = await IO_POOL.run(STORAGE.write_snapshot, payload, covered, admit=False)
+            STORAGE.finish_snapshot(staged)
+        METRICS.observe('snapshot_seconds', time.perf_counter() - start)
+        METRICS.set('snapshot_bytes', len(payload))
+        _journal_pending = max(0, _journal_pending - pending)
+
+        logger.info(f"Snapshot saved: {len(payload)} bytes (seq {seq})")
     except Exception as e:
         logger.error(f"Error saving data: {e}")
 
 
+async def compact_data_callback(context: CallbackContext):
+    """Background task that folds the journal into a new snapshot."""
+    if _journal_pending >= COMPACT_MIN_RECORDS:
+        await save_data_async()
+
+
+
+
 logger = logging.getLogger(__name__)
 
-USERS, _last_price, _last_price_time = load_data()
 
 def get_reserved_usd(user_id):
-    return sum(
-        order['usd_amount'] for order in LIMIT_ORDERS.values()
-        if order['user_id'] == user_id and order['type'] in ['buy', 'stopbuy']
-    )
+    return USER_ORDER_INDEX.reserved_usd(user_id)
 
 def get_reserved_btc(user_id):
-    return sum(
-        order['amount'] for order in LIMIT_ORDERS.values()
-        if order['user_id'] == user_id and order['type'] in ['sell', 'stopsell']
-    )
+    return USER_ORDER_INDEX.reserved_btc(user_id)
 
 def create_limit_order(user_id: str, order_type: str, price: float, amount: float, usd_amount: float) -> str:
 
     """Create a new limit order and return its ID."""
     order_id = str(uuid4())
-    LIMIT_ORDERS[order_id] = {
+    order = {
         'user_id': user_id,
         'type': order_type,
         'price': price,
@@ -157,17 +1735,31 @@ def create_limit_order(user_id: str, order_type: str, price: float, amount: floa
         'usd_amount': usd_amount,
         'created_at': datetime.now().isoformat()
     }
+    add_limit_order(order_id, order)
 
-    save_data()
+    journal_append('order_create', order_id=order_id, order=order)
     return order_id
 
+def add_limit_order(order_id: str, order: Dict):
+    """Store an open order and index it for triggering."""
+    LIMIT_ORDERS[order_id] = order
+    ORDER_INDEX.add(order_id, order)
+    USER_ORDER_INDEX.add(order_id, order)
+
+def remove_limit_order(order_id: str) -> Dict:
+    """Remove an open order from storage and the trigger index."""
+    order = LIMIT_ORDERS.pop(order_id)
+    ORDER_INDEX.remove(order_id, order)
+    USER_ORDER_INDEX.remove(order_id, order)
+    return order
+
 def cancel_limit_order(user_id: str, order_id: str) -> bool:
     """Cancel any open order (limit or stop) if it belongs to the user."""
     if order_id in LIMIT_ORDERS:
         order = LIMIT_ORDERS[order_id]
         if order['user_id'] == user_id:
-            del LIMIT_ORDERS[order_id]
-            save_data()
+            remove_limit_order(order_id)
+            journal_append('order_cancel', order_ids=[order_id])
             return True
     return False
 
@@ -175,98 +1767,278 @@ def cancel_limit_order(user_id: str, order_id: str) -> bool:
 
 def get_user_limit_orders(user_id: str) -> List[Dict]:
     """Get all limit orders for a specific user."""
-    return [{'id': k, **v} for k, v in LIMIT_ORDERS.items() if v['user_id'] == user_id]
+    return [{'id': k, **LIMIT_ORDERS[k]} for k in USER_ORDER_INDEX.order_ids(user_id)]
 
-async def process_limit_orders(context=None):
-    """Check if any limit or stop orders can be executed based on current price."""
-    current_price = get_btc_price()
-    logger.info(f"Checking orders at current price: ${current_price:.2f}")
-    executed_orders = []
-
-    orders_to_check = sorted(LIMIT_ORDERS.items(), key=lambda x: x[1]['created_at'])
-
-    order_type_map = {
-        'buy': 'LIMIT BUY',
-        'sell': 'LIMIT SELL',
-        'stopbuy': 'STOP BUY',
-        'stopsell': 'STOP SELL'
+def create_price_alert(user_id: str, direction: str, price: float) -> str:
+    """Create a price alert and return its ID."""
+    alert_id = str(uuid4())
+    alert = {
+        'user_id': user_id,
+        'direction': direction,
+        'price': price,
+        'created_at': datetime.now().isoformat()
     }
+    ALERTS[alert_id] = alert
+    ALERT_INDEX.add(alert_id, alert)
+
+    journal_append('alert_create', alert_id=alert_id, alert=alert)
+    return alert_id
+
+def cancel_price_alert(user_id: str, alert_id: str) -> bool:
+    """Cancel a price alert if it belongs to the user."""
+    alert = ALERTS.get(alert_id)
+    if alert is None or alert['user_id'] != user_id:
+        return False
+    ALERT_INDEX.remove(alert_id, ALERTS.pop(alert_id))
+    journal_append('alert_cancel', alert_ids=[alert_id])
+    return True
+
+def get_user_price_alerts(user_id: str) -> List[Dict]:
+    return [{'id': k, **ALERTS[k]} for k in ALERT_INDEX.alert_ids(user_id)]
+
+def fire_price_alerts(price):
+    """Notify and drop every alert the new price reached."""
+    alert_ids = ALERT_INDEX.crossed(price)
+    if not alert_ids:
+        return
 
-    for order_id, order in orders_to_check:
-        try:
-            user_id = order['user_id']
-            order_type = order['type']
-            price = order['price']
-            btc_amount = order['amount']
-            usd_amount = btc_amount * price
-            user = USERS.get(user_id)
-
-            if not user:
-                logger.warning(f"User {user_id} not found for order {order_id}")
-                continue
+    for alert_id in alert_ids:
+        alert = ALERTS.pop(alert_id)
+        ALERT_INDEX.remove(alert_id, alert)
+        arrow = "📈" if alert['direction'] == 'above' else "📉"
+        BROADCASTER.notify(alert['user_id'], f"🔔 {arrow} BTC is {alert['direction']} ${alert['price']:,.2f}: now ${price:,.2f}")
+
+    journal_append('alert_fire', alert_ids=alert_ids)
+    METRICS.inc('price_alerts_fired_total', len(alert_ids))
+
+def order_crossed(order_type, trigger_price, price):
+    """Whether an order of this type triggers at this price."""
+    if order_type in OrderTriggerIndex.TRIGGER_ON_FALL:
+        return price <= trigger_price
+    return price >= trigger_price
+
+def get_fill_price(order, current_price):
+    """Price an order fills at once its trigger was touched, even if the market has moved on since."""
+    trigger_price = order['price']
+    if order['type'] == 'buy':
+        return min(trigger_price, current_price)  # a limit never fills worse than its limit
+    if order['type'] == 'sell':
+        return max(trigger_price, current_price)
+
+    slippage = STOP_SLIPPAGE_BPS / 10000 if FILL_MODEL == 'slippage' else 0.0
+    if order['type'] == 'stopbuy':
+        return trigger_price * (1 + slippage)
+    return trigger_price * (1 - slippage)
+
+ORDER_TYPE_LABELS = {
+    'buy': 'LIMIT BUY',
+    'sell': 'LIMIT SELL',
+    'stopbuy': 'STOP BUY',
+    'stopsell': 'STOP SELL'
+}
 
-            # Check if order conditions are met
-            should_execute = (
-                (order_type == 'buy' and current_price <= price) or
-                (order_type == 'sell' and current_price >= price) or
-                (order_type == 'stopbuy' and current_price >= price) or
-                (order_type == 'stopsell' and current_price <= price)
+def _grouped_cumsum(values, groups):
+    """Running total of values within each group, keeping the original order inside a group."""
+    order = np.argsort(groups, kind='stable')
+    totals = np.cumsum(values[order])
+    starts = np.flatnonzero(np.r_[True, groups[order][1:] != groups[order][:-1]])
+    group_base = totals[starts] - values[order][starts]
+    totals -= np.repeat(group_base, np.diff(np.r_[starts, len(order)]))
+    result = np.empty_like(totals)
+    result[order] = totals
+    return result
+
+def fill_orders_in_bulk(low, high, current_price, interval_start, context=None):
+    """Fill every triggered order the owner can cover from their balance at the start of the tick.
+
+    Returns (filled order ids, ids left for the per-order path), both oldest first. Orders that
+    only fit after another fill of this tick, or that fail a check, are left to the per-order path,
+    and so are their owner's other triggered orders: each user's orders still fill oldest first.
+    """
+    book = ORDER_INDEX
+    slots = book.triggered_slots(low, high, current_price, interval_start)
+    if not len(slots):
+        return [], []
+
+    codes = VectorOrderBook.TYPE_CODES
+    kind = book.kind[slots]
+    trigger = book.price[slots]
+    amount = book.amount[slots]
+    user = book.user[slots]
+    is_buy = (kind == codes['buy']) | (kind == codes['stopbuy'])
+    usd_amount = book.usd_amount[slots]  # as reserved when the order was placed
+
+    # Balances of everyone involved, looked up once; unknown users go to the per-order path
+    involved, user_pos = np.unique(user, return_inverse=True)
+    involved_ids = [book.user_ids[i] for i in involved]
+    known = np.array([uid in USERS for uid in involved_ids])
+    usd_balance = np.array([USERS[uid].usd_micros if uid in USERS else 0 for uid in involved_ids], dtype=np.int64)
+    btc_balance = np.array([USERS[uid].sats if uid in USERS else 0 for uid in involved_ids], dtype=np.int64)
+
+    # In the balances' integer units, rounded like quote_fill
+    usd_needed = _grouped_cumsum(np.where(is_buy, np.rint(usd_amount * MICROS_PER_USD), 0.0), user_pos)
+    btc_needed = _grouped_cumsum(np.where(is_buy, 0.0, np.rint(amount * SATS_PER_BTC)), user_pos)
+    ok = (
+        known[user_pos]
+        & (usd_needed <= usd_balance[user_pos])
+        & (btc_needed <= btc_balance[user_pos])
+        & (usd_amount >= MIN_TRADE_AMOUNT)
+    )
+    # A sell may need the BTC an older buy of the same tick brings; keep such users on one path
+    mixed = np.zeros(len(involved), dtype=bool)
+    mixed[user_pos[~ok]] = True
+    ok &= ~mixed[user_pos]
+
+    slippage = STOP_SLIPPAGE_BPS / 10000 if FILL_MODEL == 'slippage' else 0.0
+    fill_price = np.select(
+        [kind == codes['buy'], kind == codes['sell'], kind == codes['stopbuy']],
+        [np.minimum(trigger, current_price), np.maximum(trigger, current_price), trigger * (1 + slippage)],
+        trigger * (1 - slippage),
+    )
+    # Same integer arithmetic as execute_trade
+    now = time.time()
+    trades = defaultdict(list)
+    changes = defaultdict(lambda: [0, 0])  # user_id -> [micro-dollars, satoshis]
+    for i in np.flatnonzero(ok):
+        uid = involved_ids[user_pos[i]]
+        side = 'buy' if is_buy[i] else 'sell'
+        micros, sats, fee = quote_fill(side, float(usd_amount[i]), float(amount[i]), float(fill_price[i]))
+        trades[uid].append((side, sats / SATS_PER_BTC, micros / MICROS_PER_USD, float(fill_price[i]), fee / MICROS_PER_USD, now))
+        change = changes[uid]
+        if is_buy[i]:
+            change[0] -= micros
+            change[1] += sats
+        else:
+            change[0] += micros
+            change[1] -= sats
+
+    for uid, rows in trades.items():
+        user = USERS[uid]
+        record_fills(user, rows)
+        user.usd_micros += changes[uid][0]
+        user.sats += changes[uid][1]
+        TRADE_STORE.extend(uid, rows)
+        journal_append('trade', user_id=uid, usd=user.usd, btc=user.btc, stats=user.stats.to_dict())
+        LEADERBOARD.update_user(uid)
+        CONTEST.update_user(uid)
+
+    filled = [book.order_ids[slot] for slot in slots[ok]]
+    left = [book.order_ids[slot] for slot in slots[~ok]]
+    for i, order_id in zip(np.flatnonzero(ok), filled):
+        order = remove_limit_order(order_id)
+        if context:
+            BROADCASTER.notify(
+                order['user_id'],
+                f"🐵 Your {ORDER_TYPE_LABELS[order['type']]} order for {order['amount']:.6f} BTC "
+                f"was executed at ${fill_price[i]:,.2f}"
             )
+    if filled:
+        journal_append('order_fill', order_ids=filled)
+    return filled, left
 
-            if not should_execute:
-                continue
+async def process_limit_orders(context=None):
+    """Run one order engine pass. Passes never overlap each other or a snapshot."""
+    async with ENGINE_LOCK:
+        return await _match_limit_orders(context)
+
+async def _match_limit_orders(context=None):
+    """Execute every limit or stop order whose trigger price was touched since the last run."""
+    current_price = await fetch_btc_price()
+    low, high, interval_start = take_price_range(current_price)
+    logger.info(f"Checking orders at current price: ${current_price:.2f} (range ${low:.2f}-${high:.2f})")
+    tick_start = time.perf_counter()
+    skipped_orders = 0
+
+    # All fills of this tick reach the journal in one write
+    with journal_batch():
+        if ORDER_MATCHING == 'vector':
+            # Covered orders fill in one vectorized pass; the rest get the per-order checks below
+            executed_orders, orders_to_check = fill_orders_in_bulk(low, high, current_price, interval_start, context)
+        else:
+            # Only orders whose trigger price was touched during the interval, oldest first
+            executed_orders, orders_to_check = [], ORDER_INDEX.triggered(low, high)
+        bulk_filled = len(executed_orders)
+
+        for order_id in orders_to_check:
+            try:
+                order = LIMIT_ORDERS[order_id]
+                user_id = order['user_id']
+                order_type = order['type']
+                price = order['price']
+                btc_amount = order['amount']
+                usd_amount = order['usd_amount']
+                user = USERS.get(user_id)
+
+                if not user:
+                    logger.warning(f"User {user_id} not found for order {order_id}")
+                    continue
 
-            # Execute the trade based on order type and available funds
-            if order_type in ['buy', 'stopbuy']:
-                if user['usd'] >= usd_amount:
-                    success, msg = execute_trade(user_id, 'buy', usd_amount, context)
-                else:
-                    success = False
-                    msg = "❌ 🙈 Order skipped: not enough USD."
+                # The interval's extremes may predate this order; then only the current price counts
+                created_ts = datetime.fromisoformat(order['created_at']).timestamp()
+                if created_ts > interval_start and not order_crossed(order_type, price, current_price):
+                    continue
+
+                fill_price = get_fill_price(order, current_price)
+
+                # Execute the trade based on order type and available funds
+                if order_type in ['buy', 'stopbuy']:
+                    if user.usd_micros >= to_micros(usd_amount):
+                        success, msg = execute_trade(user_id, 'buy', usd_amount, context, fill_price=fill_price)
+                    else:
+                        success = False
+                        msg = "❌ 🙈 Order skipped: not enough USD."
+
+                elif order_type in ['sell', 'stopsell']:
+                    if user.sats >= to_sats(btc_amount):
+                        success, msg = execute_trade(user_id, 'sell', usd_amount, context,
+                                                     btc_amount_override=btc_amount, fill_price=fill_price)
+                    else:
+                        success = False
+                        msg = "❌ 🙈 Order skipped: not enough BTC."
 
-            elif order_type in ['sell', 'stopsell']:
-                if user['btc'] >= btc_amount:
-                    success, msg = execute_trade(user_id, 'sell', usd_amount, context, btc_amount_override=btc_amount)
                 else:
                     success = False
-                    msg = "❌ 🙈 Order skipped: not enough BTC."
-
-            else:
-                success = False
-                msg = "❌ 🙈 Unknown order type."
+                    msg = "❌ 🙈 Unknown order type."
 
-            if success:
-                del LIMIT_ORDERS[order_id]
-                executed_orders.append(order_id)
-                logger.info(f"✅ Order {order_id} executed.")
+                if success:
+                    remove_limit_order(order_id)
+                    journal_append('order_fill', order_ids=[order_id])
+                    executed_orders.append(order_id)
+                    logger.info(f"✅ Order {order_id} executed at ${fill_price:,.2f}.")
 
-                if context:
-                    order_type_label = order_type_map.get(order_type, order_type.upper())
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text=f"🐵 Your {order_type_label} order for {btc_amount:.6f} BTC was executed at ${current_price:,.2f}"
-                    )
+                    if context:
+                        order_type_label = ORDER_TYPE_LABELS.get(order_type, order_type.upper())
+                        BROADCASTER.notify(
+                            user_id,
+                            f"🐵 Your {order_type_label} order for {btc_amount:.6f} BTC was executed at ${fill_price:,.2f}"
+                        )
 
-            else:
-                del LIMIT_ORDERS[order_id]
-                reason = "not enough USD." if order_type in ['buy', 'stopbuy'] else "not enough BTC."
-                order_type_label = order_type_map.get(order_type, order_type.upper())
+                else:
+                    remove_limit_order(order_id)
+                    journal_append('order_skip', order_ids=[order_id])
+                    skipped_orders += 1
+                    reason = "not enough USD." if order_type in ['buy', 'stopbuy'] else "not enough BTC."
+                    order_type_label = ORDER_TYPE_LABELS.get(order_type, order_type.upper())
 
-                logger.warning(f"{msg} (Order {order_id})")
+                    logger.warning(f"{msg} (Order {order_id})")
 
-                if context:
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text=f"❌ Your {order_type_label} order for {btc_amount:.6f} BTC at ${price:,.2f} was skipped: {reason}"
-                    )
+                    if context:
+                        BROADCASTER.notify(
+                            user_id,
+                            f"❌ Your {order_type_label} order for {btc_amount:.6f} BTC at ${price:,.2f} was skipped: {reason}"
+                        )
 
-        except Exception as e:
-            logger.error(f"Error processing order {order_id}: {e}")
+            except Exception as e:
+                logger.error(f"Error processing order {order_id}: {e}")
 
     if executed_orders:
-        save_data()
         logger.info(f"Executed orders: {executed_orders}")
 
+    METRICS.observe('order_tick_seconds', time.perf_counter() - tick_start)
+    METRICS.inc('orders_triggered_total', bulk_filled + len(orders_to_check))
+    METRICS.inc('orders_filled_total', len(executed_orders))
+    METRICS.inc('orders_skipped_total', skipped_orders)
+    METRICS.set('open_orders', len(LIMIT_ORDERS))
     return executed_orders
 
 
@@ -287,7 +2059,7 @@ async def stopbuy(update: Update, context: ContextTypes.DEFAULT_TYPE):
         usd_amount = float(context.args[1])
         btc_amount = usd_amount / price
         reserved = get_reserved_usd(user_id)
-        if usd_amount + reserved > USERS[user_id]['usd']:
+        if usd_amount + reserved > USERS[user_id].usd:
             await update.effective_chat.send_message("❌ 🙈 Not enough usd. (including reserved funds for active orders)")
             return
 
@@ -295,7 +2067,7 @@ async def stopbuy(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.effective_chat.send_message("❌ 🙈 Price and amount must be positive.")
             return
 
-        if USERS[user_id]['usd'] < usd_amount:
+        if USERS[user_id].usd < usd_amount:
             await update.effective_chat.send_message(f"❌ 🙈 Insufficient USD. You need ${usd_amount:,.2f}.")
             return
 
@@ -327,7 +2099,7 @@ async def stopsell(update: Update, context: ContextTypes.DEFAULT_TYPE):
         usd_amount = btc_amount * price
         reserved = get_reserved_btc(user_id)
 
-        if btc_amount + reserved > USERS[user_id]['btc']:
+        if btc_amount + reserved > USERS[user_id].btc:
             await update.effective_chat.send_message("❌ 🙈 Not enough BTC. (including reserved funds for active orders)")
             return
 
@@ -347,21 +2119,22 @@ async def stopsell(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.effective_chat.send_message("❌ 🙈 Invalid input. Use numbers for price and BTC amount.")
 
+@rate_limited('callback')
 async def handle_cancel_all_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
     user_id = str(query.from_user.id)
-    user_orders = [k for k, v in LIMIT_ORDERS.items() if v['user_id'] == user_id]
+    user_orders = USER_ORDER_INDEX.order_ids(user_id)
 
     if not user_orders:
         await query.edit_message_text("❌ 🙈 You have no active orders to cancel.")
         return
 
     for order_id in user_orders:
-        del LIMIT_ORDERS[order_id]
+        remove_limit_order(order_id)
 
-    save_data()
+    journal_append('order_cancel', order_ids=user_orders)
     await query.edit_message_text(f"✅ Cancelled {len(user_orders)} active orders.")
 
 
@@ -382,7 +2155,7 @@ async def limitbuy(update: Update, context: ContextTypes.DEFAULT_TYPE):
         btc_amount = usd_amount / price
 
         reserved = get_reserved_usd(user_id)
-        if usd_amount + reserved > USERS[user_id]['usd']:
+        if usd_amount + reserved > USERS[user_id].usd:
             await update.effective_chat.send_message("❌ 🙈 Not enough usd. (including reserved funds for active orders)")
             return
         
@@ -391,8 +2164,8 @@ async def limitbuy(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         # Check if user has enough USD 
-        if USERS[user_id]['usd'] < usd_amount:
-            await update.effective_chat.send_message(f"❌ 🙈 Insufficient USD. You have ${USERS[user_id]['usd']:,.2f}, need ${usd_amount:,.2f}.")
+        if USERS[user_id].usd < usd_amount:
+            await update.effective_chat.send_message(f"❌ 🙈 Insufficient USD. You have ${USERS[user_id].usd:,.2f}, need ${usd_amount:,.2f}.")
             return
 
         # Create the limit order 
@@ -426,7 +2199,7 @@ async def limitsell(update: Update, context: ContextTypes.DEFAULT_TYPE):
         usd_amount = btc_amount * price
         reserved = get_reserved_btc(user_id)
 
-        if btc_amount + reserved > USERS[user_id]['btc']:
+        if btc_amount + reserved > USERS[user_id].btc:
             await update.effective_chat.send_message("❌ 🙈 Not enough BTC. (including reserved funds for active orders)")
             return
 
@@ -460,16 +2233,10 @@ async def my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_chat.send_message("❌ 🙈 You have no active limit or stop orders.")
         return
 
-    current_price = get_btc_price()
+    current_price = await fetch_btc_price()
 
     for order in orders:
-        order_type_map = {
-            'buy': 'LIMIT BUY',
-            'sell': 'LIMIT SELL',
-            'stopbuy': 'STOP BUY',
-            'stopsell': 'STOP SELL'
-        }
-        order_type = order_type_map.get(order['type'], order['type'].upper())
+        order_type = ORDER_TYPE_LABELS.get(order['type'], order['type'].upper())
         created_at = datetime.fromisoformat(order['created_at']).strftime("%Y-%m-%d %H:%M")
 
         diff_pct = 0
@@ -509,6 +2276,7 @@ async def my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]])
     await update.effective_chat.send_message("🔚 Cancel all orders", reply_markup=cancel_all_keyboard)
 
+@rate_limited('callback')
 async def handle_cancel_order_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -521,133 +2289,728 @@ async def handle_cancel_order_button(update: Update, context: ContextTypes.DEFAU
     else:
         await query.edit_message_text("❌ 🙈 Could not cancel this order.")
 
-        
-
-
-@rate_limit_decorator
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    help_text = (
-        "📘 *Available Commands:*\n\n"
-        "👤 *Account*\n"
-        "᛫ /register `<nickname>` - Register with a unique nickname\n"
-        "᛫ /portfolio - View your BTC and USD balance\n"
-        "᛫ /myorders - View and cancel your active orders\n"
-        "᛫ /history - View your recent trades\n\n"
-        "📈 *Trading (0.1% trading fee)*\n"
-        "᛫ /buy  - Market buy BTC\n"
-        "᛫ /sell - Market sell BTC\n"
-        "᛫ /limitbuy `<price>` `<usd amount>`\n- Buy if BTC drops to target\n"
-        "᛫ /stopbuy `<price>` `<usd amount>`\n- Buy if BTC rises to target\n"
-        "᛫ /limitsell `<price>` `<btc amount>`\n- Sell if BTC rises to target\n"
-        "᛫ /stopsell `<price>` `<btc amount>`\n- Sell if BTC drops to target\n\n"
-        "🏆 *Competition*\n"
-        "᛫ /leaderboard - See the top traders\n"        
-        "᛫ /claimprize - Claim winnings if your PnL is $3,000+ \n(*you must use this command to claim the prize!*)\nAll users will be notified of the winner\n\n"
-        "🛠 *Other*\n"
-        "᛫ /news - view breaking BTC news headlines\n"
-        "᛫ /price - Show current BTC price\n"
-        "᛫ /chart - View BTC price chart\n"
-        "᛫ /help - Show this help message\n\n"
-        "*New*: Join this channel for future contest announcements: https://t.me/Goldkingcoinerscontests"
-    )
-    await update.effective_chat.send_message(help_text, parse_mode="Markdown")
-
 
 @rate_limit_decorator
-async def news(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def alert(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     if user_id not in USERS:
         await update.effective_chat.send_message("❌ 🙈 You need to /register first.")
         return
 
-    chat_id = update.effective_chat.id
-    progress_message = await context.bot.send_message(chat_id=chat_id, text="Fetching news, please wait... ⏳")
+    if not context.args or len(context.args) != 2 or context.args[0].lower() not in PriceAlertIndex.DIRECTIONS:
+        await update.effective_chat.send_message("How to use:\n\n /alert <above|below> <BTC price>\n\nExample: /alert above 120000")
+        return
 
     try:
-        combined_articles = []
-        seen_titles = []
-        seen_links = set()
-
-        for source_name, url in RSS_FEEDS.items():
-            feed = feedparser.parse(url)
-            entries = feed.entries[:5]  # top 5 from each source
-            for entry in entries:
-                new_title = entry.title.strip()
-                new_link = entry.link
-
-                if new_link in seen_links:
-                    continue  # skip if URL already seen
-
-                # Check fuzzy similarity with titles seen
-                is_duplicate = False
-                for seen_title in seen_titles:
-                    similarity = fuzz.ratio(new_title.lower(), seen_title.lower())
-                    if similarity > 55:
-                        is_duplicate = True
-                        break
-                if is_duplicate:
-                    continue
+        direction = context.args[0].lower()
+        price = float(context.args[1])
 
-                seen_titles.append(new_title)
-                seen_links.add(new_link)
+        if price <= 0:
+            await update.effective_chat.send_message("❌ 🙈 Price must be positive.")
+            return
 
-                combined_articles.append({
-                    "title": escape(entry.title.replace("$", "＄")),
-                    "link": new_link,
-                    "source": source_name,
-                    "published": entry.get('published', '')
-                })
+        if len(ALERT_INDEX.alert_ids(user_id)) >= MAX_ALERTS_PER_USER:
+            await update.effective_chat.send_message(f"❌ 🙈 You already have {MAX_ALERTS_PER_USER} alerts. Use /alerts to cancel some.")
+            return
 
-        if not combined_articles:
-            await update.effective_chat.send_message("❌ 🙈 No news found at the moment.")
-            await progress_message.delete()
+        current_price = await fetch_btc_price()
+        reached = current_price >= price if direction == 'above' else current_price <= price
+        if reached:
+            await update.effective_chat.send_message(f"❌ 🙈 BTC is already {direction} ${price:,.2f} (now ${current_price:,.2f}).")
             return
 
-        combined_articles = combined_articles[:20]
+        create_price_alert(user_id, direction, price)
+        await update.effective_chat.send_message(
+            f"🔔 Alert set: BTC {direction} ${price:,.2f} (now ${current_price:,.2f}).\n"
+            f"Use /alerts to view or cancel your alerts."
+        )
 
-        news_text = "📰 <b>Top Crypto News</b>:\n\n"
-        for article in combined_articles:
-            news_text += f"• <a href='{article['link']}'>{article['title']}</a> <i>({article['source']})</i>\n"
+    except ValueError:
+        await update.effective_chat.send_message("❌ 🙈 Invalid input. Use a number for the price.")
+    except Exception as e:
+        logger.error(f"alert: {e}")
+        await update.effective_chat.send_message("❌ 🙈 Couldn't fetch data. Please try again later.")
 
-        await update.effective_chat.send_message(news_text, parse_mode="HTML")
 
-    except Exception as e:
+def render_price_alerts(user_id):
+    """Text and cancel buttons for a user's alerts."""
+    alerts = get_user_price_alerts(user_id)
+    if not alerts:
+        return "❌ 🙈 You have no price alerts. Set one with /alert <above|below> <price>.", None
+
+    lines = ["🔔 Your price alerts:\n"]
+    buttons = []
+    for a in alerts:
+        lines.append(f"• BTC {a['direction']} ${a['price']:,.2f}")
+        buttons.append([InlineKeyboardButton(f"❌ {a['direction']} ${a['price']:,.0f}", callback_data=f"cancelalert_{a['id']}")])
+    return "\n".join(lines), InlineKeyboardMarkup(buttons)
+
+
+@rate_limit_decorator
+async def alerts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    if user_id not in USERS:
+        await update.effective_chat.send_message("❌ 🙈 You need to /register first.")
+        return
+
+    text, keyboard = render_price_alerts(user_id)
+    await update.effective_chat.send_message(text, reply_markup=keyboard)
+
+
+@rate_limited('callback')
+async def handle_cancel_alert_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+    alert_id = query.data.replace("cancelalert_", "")
+
+    if cancel_price_alert(user_id, alert_id):
+        await query.answer("✅ Alert cancelled.")
+    else:
+        await query.answer("❌ 🙈 This alert already fired or was cancelled.")
+
+    text, keyboard = render_price_alerts(user_id)
+    await query.edit_message_text(text, reply_markup=keyboard)
+
+        
+
+
+@rate_limit_decorator
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    help_text = (
+        "📘 *Available Commands:*\n\n"
+        "👤 *Account*\n"
+        "᛫ /register `<nickname>` - Register with a unique nickname\n"
+        "᛫ /portfolio - View your BTC and USD balance\n"
+        "᛫ /myorders - View and cancel your active orders\n"
+        "᛫ /history - Browse your trade history\n"
+        "᛫ /stats - Average entry, realized PnL, fees and win rate\n\n"
+        "📈 *Trading (0.1% trading fee)*\n"
+        "᛫ /buy  - Market buy BTC\n"
+        "᛫ /sell - Market sell BTC\n"
+        "᛫ /limitbuy `<price>` `<usd amount>`\n- Buy if BTC drops to target\n"
+        "᛫ /stopbuy `<price>` `<usd amount>`\n- Buy if BTC rises to target\n"
+        "᛫ /limitsell `<price>` `<btc amount>`\n- Sell if BTC rises to target\n"
+        "᛫ /stopsell `<price>` `<btc amount>`\n- Sell if BTC drops to target\n\n"
+        "🏆 *Competition*\n"
+        "᛫ /leaderboard - See the top traders\n"        
+        "᛫ /rank - See your position and the gap to the next trader\n"
+        f"᛫ /claimprize - Claim winnings if your PnL is ${CONTEST_PNL_TARGET:,.0f}+ \n(*you must use this command to claim the prize!*)\nAll users will be notified of the winner\n\n"
+        "🛠 *Other*\n"
+        "᛫ /news - view breaking BTC news headlines\n"
+        "᛫ /price - Show current BTC price\n"
+        "᛫ /alert `<above|below>` `<price>` - Get a message when BTC gets there\n"
+        "᛫ /alerts - View and cancel your price alerts\n"
+        "᛫ /chart [timeframe] [window] [me] - View BTC price chart\n"
+        "᛫ /help - Show this help message\n\n"
+        "*New*: Join this channel for future contest announcements: https://t.me/Goldkingcoinerscontests"
+    )
+    await update.effective_chat.send_message(help_text, parse_mode="Markdown")
+
+
+@rate_limited('heavy')
+async def news(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    if user_id not in USERS:
+        await update.effective_chat.send_message("❌ 🙈 You need to /register first.")
+        return
+
+    # Headlines are fetched in the background; this only serves the cached text
+    if not _news_text:
+        await update.effective_chat.send_message("❌ 🙈 No news found at the moment. Please try again later.")
+        return
+
+    news_text = _news_text
+    news_age = get_news_age()
+    if news_age > NEWS_STALE_AFTER:
+        news_text += f"\n⚠️ <i>Some sources haven't updated for {news_age / 60:.0f} min.</i>"
+
+    await update.effective_chat.send_message(news_text, parse_mode="HTML")
+
+
+# --- News Ingestion ---
+async def _fetch_feed(source_name, url):
+    """Fetch one feed with a conditional GET. Returns True if its entries changed."""
+    global _news_session
+
+    if _news_session is None or _news_session.closed:
+        _news_session = aiohttp.ClientSession()
+
+    state = _news_feeds.setdefault(source_name, {'etag': None, 'modified': None, 'entries': [], 'last_success': 0})
+    headers = {}
+    if state['etag']:
+        headers['If-None-Match'] = state['etag']
+    if state['modified']:
+        headers['If-Modified-Since'] = state['modified']
+
+    try:
+        async with _news_session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=NEWS_FEED_TIMEOUT)) as response:
+            if response.status == 304:
+                state['last_success'] = time.time()
+                return False
+            response.raise_for_status()
+            body = await response.read()
+            etag = response.headers.get('ETag')
+            modified = response.headers.get('Last-Modified')
+
+        # Parsing is CPU-bound; keep it off the event loop
+        import feedparser
+        feed = await IO_POOL.run(feedparser.parse, body, admit=False)
+        state['entries'] = [
+            (entry.title.strip(), entry.link, entry.get('published', ''))
+            for entry in feed.entries[:5]  # top 5 from each source
+        ]
+        state['etag'] = etag
+        state['modified'] = modified
+        state['last_success'] = time.time()
+        return True
+
+    except Exception as e:
+        logger.warning(f"News feed {source_name} failed: {e}")
+        return False
+
+
+def _render_news():
+    """Deduplicate the cached entries across feeds and pre-render the /news message."""
+    global _news_text
+    from rapidfuzz import fuzz
+
+    combined_articles = []
+    seen_titles = []
+    seen_links = set()
+
+    for source_name in RSS_FEEDS:
+        for new_title, new_link, published in _news_feeds.get(source_name, {}).get('entries', []):
+            if new_link in seen_links:
+                continue  # skip if URL already seen
+
+            # Check fuzzy similarity with titles seen
+            is_duplicate = False
+            for seen_title in seen_titles:
+                similarity = fuzz.ratio(new_title.lower(), seen_title.lower())
+                if similarity > 55:
+                    is_duplicate = True
+                    break
+            if is_duplicate:
+                continue
+
+            seen_titles.append(new_title)
+            seen_links.add(new_link)
+
+            combined_articles.append({
+                "title": escape(new_title.replace("$", "＄")),
+                "link": new_link,
+                "source": source_name,
+                "published": published
+            })
+
+    if not combined_articles:
+        _news_text = None
+        return
+
+    news_text = "📰 <b>Top Crypto News</b>:\n\n"
+    for article in combined_articles[:20]:
+        news_text += f"• <a href='{article['link']}'>{article['title']}</a> <i>({article['source']})</i>\n"
+    _news_text = news_text
+
+
+async def refresh_news():
+    """Poll every feed concurrently and re-render the headlines if any feed changed."""
+    if not all(name in sys.modules for name in NEWS_MODULES):
+        # Only the news libraries; the full warm-up waits for the first poll
+        await IO_POOL.run(import_news_modules, admit=False)
+    changed = await asyncio.gather(*(_fetch_feed(name, url) for name, url in RSS_FEEDS.items()))
+    if any(changed):
+        _render_news()
+        logger.info(f"News refreshed: {sum(changed)} of {len(RSS_FEEDS)} feeds changed")
+
+
+def get_news_age():
+    """Seconds since the stalest feed last answered; one that never has is as old as the bot's uptime."""
+    now = time.time()
+    oldest = min((_news_feeds.get(name, {}).get('last_success') or _news_started for name in RSS_FEEDS), default=now)
+    return now - oldest
+
+
+async def refresh_news_callback(context: CallbackContext):
+    """Background task that keeps the news headlines fresh."""
+    try:
+        await refresh_news()
+    except Exception as e:
         logger.error(f"Crypto news fetch error: {e}")
-        await update.effective_chat.send_message("❌ 🙈 Failed to fetch news. Please try again later.")
-    finally:
-        await progress_message.delete()
 
 
+async def close_news_session():
+    if _news_session is not None and not _news_session.closed:
+        await _news_session.close()
+
+
+# --- Outbound Messages ---
+class Broadcaster:
+    """Single outbound path for notifications and durable broadcasts, paced to Telegram's flood limits."""
+
+    def __init__(self, rate, per_chat_interval):
+        self.rate = rate  # messages per second across all chats
+        self.per_chat_interval = per_chat_interval
+        self.bot = None
+        self._notifications = deque()
+        self._wakeup = asyncio.Event()
+        self._next_slot = 0.0
+        self._last_sent = {}  # chat_id -> monotonic time of the last send
+        self._journaled = {}  # broadcast_id -> (cursor, monotonic time) of its last journaled progress
+        self._task = None
+
+    def start(self, bot):
+        self.bot = bot
+        self._task = asyncio.create_task(self._run())
+        if BROADCASTS:
+            logger.info(f"Resuming {len(BROADCASTS)} unfinished broadcast(s)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def notify(self, chat_id, text, **kwargs):
+        """Queue a one-off message. Sent ahead of any broadcast in progress, but not persisted."""
+        self._notifications.append((chat_id, text, kwargs))
+        self._wakeup.set()
+
+    def start_broadcast(self, text, chat_ids):
+        """Persist a broadcast and start sending it in the background. Survives restarts.
+
+        Progress is journaled every BROADCAST_JOURNAL_EVERY sends or BROADCAST_JOURNAL_INTERVAL
+        seconds, so a restart resends at most that many messages. Blocked chats are left out.
+        """
+        broadcast_id = str(uuid4())
+        BROADCASTS[broadcast_id] = {
+            'text': text,
+            'chat_ids': [chat_id for chat_id in chat_ids if str(chat_id) not in BLOCKED_CHATS],
+            'cursor': 0,
+            'sent': 0,
+            'failed': 0,
+            'created_at': datetime.now().isoformat()
+        }
+        journal_append('broadcast_create', broadcast_id=broadcast_id, broadcast=BROADCASTS[broadcast_id])
+        self._wakeup.set()
+        return broadcast_id
+
+    async def _run(self):
+        while True:
+            try:
+                if self._notifications:
+                    chat_id, text, kwargs = self._notifications.popleft()
+                    await self._deliver(chat_id, text, **kwargs)
+                elif BROADCASTS:
+                    await self._send_next_broadcast_message(next(iter(BROADCASTS)))
+                else:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbound message error: {e}")
+
+    async def _send_next_broadcast_message(self, broadcast_id):
+        broadcast = BROADCASTS[broadcast_id]
+        total = len(broadcast['chat_ids'])
+
+        if broadcast['cursor'] < total:
+            chat_id = broadcast['chat_ids'][broadcast['cursor']]
+            if await self._deliver(chat_id, broadcast['text']):
+                broadcast['sent'] += 1
+            else:
+                broadcast['failed'] += 1
+            broadcast['cursor'] += 1
+
+            now = time.monotonic()
+            journaled_cursor, journaled_at = self._journaled.setdefault(broadcast_id, (0, now))
+            if (broadcast['cursor'] < total and (broadcast['cursor'] - journaled_cursor >= BROADCAST_JOURNAL_EVERY
+                                                 or now - journaled_at >= BROADCAST_JOURNAL_INTERVAL)):
+                journal_append('broadcast_progress', broadcast_id=broadcast_id, cursor=broadcast['cursor'],
+                               sent=broadcast['sent'], failed=broadcast['failed'])
+                self._journaled[broadcast_id] = (broadcast['cursor'], now)
+
+            if broadcast['cursor'] % 100 == 0:
+                logger.info(f"Broadcast {broadcast_id}: {broadcast['cursor']}/{total} processed")
+
+        if broadcast['cursor'] >= total:
+            del BROADCASTS[broadcast_id]
+            self._journaled.pop(broadcast_id, None)
+            journal_append('broadcast_done', broadcast_id=broadcast_id)
+            logger.info(f"Broadcast {broadcast_id} finished: {broadcast['sent']} sent, {broadcast['failed']} failed")
+
+    async def _pace(self, chat_id):
+        """Wait for a free global send slot and for this chat's own cooldown."""
+        now = time.monotonic()
+        ready_at = max(self._next_slot, self._last_sent.get(chat_id, 0.0) + self.per_chat_interval)
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+            now = time.monotonic()
+
+        self._next_slot = max(self._next_slot, now) + 1.0 / self.rate
+        self._last_sent[chat_id] = now
+
+        if len(self._last_sent) > 10000:
+            # Forget chats whose cooldown has long expired so this stays bounded
+            cutoff = now - self.per_chat_interval
+            self._last_sent = {cid: t for cid, t in self._last_sent.items() if t > cutoff}
+
+    async def _deliver(self, chat_id, text, **kwargs):
+        """Send one message, honouring flood control. Returns False if the chat was dropped."""
+        if str(chat_id) in BLOCKED_CHATS:
+            METRICS.inc('outbound_messages_total', result='blocked')
+            return False
+        for attempt in range(BROADCAST_MAX_ATTEMPTS):
+            await self._pace(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                METRICS.inc('outbound_messages_total', result='sent')
+                return True
+            except RetryAfter as e:
+                METRICS.inc('outbound_messages_total', result='retry_after')
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                logger.warning(f"Flood control hit, pausing sends for {retry_after}s")
+                # Telegram's limit is global to the bot, so hold every send, not just this one
+                self._next_slot = max(self._next_slot, time.monotonic() + retry_after)
+            except Forbidden as e:
+                METRICS.inc('outbound_messages_total', result='dropped')
+                logger.info(f"Dropping chat {chat_id} (blocked or deactivated): {e}")
+                block_chat(chat_id)
+                return False
+            except BadRequest as e:
+                METRICS.inc('outbound_messages_total', result='dropped')
+                logger.warning(f"Dropping message to {chat_id}: {e}")
+                return False
+            except (TimedOut, NetworkError) as e:
+                logger.warning(f"Failed to notify user {chat_id} (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
+            except TelegramError as e:
+                # Anything else won't go away on retry; move on so one chat can't stall the queue
+                METRICS.inc('outbound_messages_total', result='failed')
+                logger.warning(f"Failed to notify user {chat_id}: {e}")
+                return False
+        METRICS.inc('outbound_messages_total', result='failed')
+        return False
+
+
+BROADCASTER = Broadcaster(BROADCAST_RATE, BROADCAST_PER_CHAT_INTERVAL)
+
+
+def block_chat(chat_id):
+    """Remember a chat that blocked the bot so broadcasts and notifications stop trying it."""
+    chat_id = str(chat_id)
+    if chat_id not in BLOCKED_CHATS:
+        BLOCKED_CHATS.add(chat_id)
+        journal_append('chat_blocked', chat_id=chat_id)
+
+def unblock_chat(chat_id):
+    chat_id = str(chat_id)
+    if chat_id in BLOCKED_CHATS:
+        BLOCKED_CHATS.discard(chat_id)
+        journal_append('chat_unblocked', chat_id=chat_id)
+
+
+@rate_limit_decorator
+async def broadcasts(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin-only progress report for broadcasts still being sent."""
+    if str(update.effective_user.id) not in ADMIN_IDS:
+        return
+
+    if not BROADCASTS:
+        await update.effective_chat.send_message("📭 No broadcasts in progress.")
+        return
+
+    lines = ["📣 Broadcasts in progress:\n"]
+    for broadcast_id, broadcast in BROADCASTS.items():
+        lines.append(
+            f"• {broadcast_id[:8]}: {broadcast['cursor']}/{len(broadcast['chat_ids'])} "
+            f"({broadcast['sent']} sent, {broadcast['failed']} failed)"
+        )
+    await update.effective_chat.send_message("\n".join(lines))
 
 
 # --- Price API ---
-def get_btc_price():
-    global _last_price, _last_price_time
+async def _fetch_btc_price():
+    global _price_session
+
+    if _price_session is None or _price_session.closed:
+        _price_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=PRICE_HTTP_TIMEOUT))
+
+    start = time.perf_counter()
     try:
-        current_time = time.time()
-        if current_time - _last_price_time < 30 and _last_price:
-            return _last_price
+        async with _price_session.get(BINANCE_PRICE_URL) as response:
+            response.raise_for_status()
+            data = await response.json()
+    except Exception:
+        METRICS.inc('price_fetch_errors_total')
+        raise
+    METRICS.observe('price_fetch_seconds', time.perf_counter() - start)
 
-        response = requests.get(
-            "https://api.binance.com/api/v3/ticker/price?symbol=BTCUSDT",
-            timeout=30
-        )
-        response.raise_for_status()
+    return set_btc_price(float(data["price"]))
 
-        data = response.json()
-        _last_price = float(data["price"])  # Access price here
-        _last_price_time = current_time
-        save_data()
-        return _last_price
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Price check failed: {e}")
-        if _last_price:
-            return _last_price
+
+def set_btc_price(new_price):
+    """Store a fresh price, journaling it at most every PRICE_JOURNAL_INTERVAL seconds."""
+    global _last_price, _last_price_time, _price_journaled_at
+
+    _last_price = new_price
+    _last_price_time = time.time()
+    observe_price_range(new_price, new_price)
+    CANDLE_ARCHIVE.record_tick(new_price, _last_price_time)
+    fire_price_alerts(new_price)
+    check_contest(new_price)
+    if _last_price_time - _price_journaled_at >= PRICE_JOURNAL_INTERVAL:
+        journal_append('price', last_price=_last_price, last_price_time=_last_price_time)
+        _price_journaled_at = _last_price_time
+    return _last_price
+
+
+async def refresh_btc_price():
+    """Fetch a fresh price. Concurrent callers share one in-flight request."""
+    global _price_refresh_task
+
+    if _price_refresh_task is None or _price_refresh_task.done():
+        _price_refresh_task = asyncio.create_task(_fetch_btc_price())
+
+    # Shield so a cancelled caller doesn't cancel the refresh other callers are waiting on
+    return await asyncio.shield(_price_refresh_task)
+
+
+def schedule_price_refresh():
+    """Start a background refresh if none is running; never waits for it."""
+    global _price_refresh_task
+
+    if _price_refresh_task is not None and not _price_refresh_task.done():
+        return
+    try:
+        _price_refresh_task = asyncio.get_running_loop().create_task(_fetch_btc_price())
+        _price_refresh_task.add_done_callback(_log_price_refresh_error)
+    except RuntimeError:
+        pass  # No event loop running; the periodic job will refresh it
+
+
+def _log_price_refresh_error(task):
+    if not task.cancelled() and task.exception():
+        logger.error(f"Price check failed: {task.exception()}")
+
+
+def observe_price_range(low, high):
+    """Widen the current interval's high/low."""
+    global _range_low, _range_high
+    _range_low = low if _range_low is None else min(_range_low, low)
+    _range_high = high if _range_high is None else max(_range_high, high)
+
+
+def take_price_range(current_price):
+    """Return (low, high, start time) of the interval since the last call and start a new one at current_price."""
+    global _range_low, _range_high, _range_started_at
+    low = current_price if _range_low is None else min(_range_low, current_price)
+    high = current_price if _range_high is None else max(_range_high, current_price)
+    started_at = _range_started_at
+
+    _range_low = _range_high = current_price
+    _range_started_at = time.time()
+    return low, high, started_at
+
+
+async def refresh_price_range():
+    """Fold the exchange's 1-second candles since the interval began into its high/low, catching spikes between polls."""
+    global _price_session
+
+    if _price_session is None or _price_session.closed:
+        _price_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=PRICE_HTTP_TIMEOUT))
+
+    # Only whole candles that opened inside the interval, so nothing from before it leaks in
+    start_ms = int(math.ceil(_range_started_at)) * 1000
+    try:
+        async with _price_session.get(BINANCE_KLINES_URL, params={'startTime': start_ms, 'limit': 1000}) as response:
+            response.raise_for_status()
+            candles = await response.json()
+    except Exception as e:
+        logger.warning(f"Price range fetch failed, matching on the polled prices only: {e}")
+        return
+
+    if candles:
+        observe_price_range(min(float(c[3]) for c in candles), max(float(c[2]) for c in candles))
+
+
+def get_btc_price_age():
+    """Seconds since the cached price was fetched."""
+    return time.time() - _last_price_time
+
+
+def get_btc_price():
+    """Return the cached BTC price from memory, refreshing in the background if it's stale."""
+    if get_btc_price_age() >= PRICE_MAX_AGE:
+        METRICS.inc('price_cache_total', result='stale')
+        schedule_price_refresh()
+    else:
+        METRICS.inc('price_cache_total', result='hit')
+
+    if not _last_price:
         raise Exception("Price service unavailable. Please try again later.")
+    return _last_price
+
+
+async def fetch_btc_price():
+    """Like get_btc_price(), but waits for the first price if none has been fetched yet."""
+    if not _last_price:
+        METRICS.inc('price_cache_total', result='miss')
+        try:
+            return await refresh_btc_price()
+        except Exception as e:
+            logger.error(f"Price check failed: {e}")
+            raise Exception("Price service unavailable. Please try again later.")
+    return get_btc_price()
+
+
+async def refresh_price_callback(context: CallbackContext):
+    """Background task that keeps the cached price fresh."""
+    if PRICE_STREAM_ENABLED and get_btc_price_age() < PRICE_REFRESH_INTERVAL:
+        return  # the stream is delivering prices; polling is only a fallback
+    try:
+        await refresh_btc_price()
+    except Exception as e:
+        logger.error(f"Price check failed: {e}")
+
+
+async def close_price_session():
+    if _price_session is not None and not _price_session.closed:
+        await _price_session.close()
+
+# --- Price Stream ---
+async def run_price_stream():
+    """Consume the exchange trade stream and push every price straight into the order engine."""
+    backoff = 1.0
+    while True:
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.ws_connect(PRICE_STREAM_URL, heartbeat=30.0) as ws:
+                    logger.info(f"Price stream connected: {PRICE_STREAM_URL}")
+                    backoff = 1.0
+                    async for message in ws:
+                        if message.type != aiohttp.WSMsgType.TEXT:
+                            break
+                        data = json.loads(message.data)
+                        # Trade streams carry 'p', ticker streams carry the last price in 'c'
+                        on_price_tick(float(data.get('p') or data['c']))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Price stream error: {e}")
+
+        logger.warning(f"Price stream disconnected, reconnecting in {backoff:.0f}s")
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 60.0)
+
+
+def on_price_tick(price):
+    """Record a streamed price and wake the order engine."""
+    set_btc_price(price)
+    METRICS.inc('price_stream_messages_total')
+    _order_engine_wakeup.set()
+
+
+async def run_order_engine(application):
+    """Run the order engine after price ticks; any burst of ticks during a run collapses into one rerun."""
+    while True:
+        await _order_engine_wakeup.wait()
+        _order_engine_wakeup.clear()
+        try:
+            await process_limit_orders(application)
+            METRICS.inc('order_engine_runs_total')
+        except Exception as e:
+            logger.error(f"Error in limit order processing task: {e}")
+        await asyncio.sleep(ORDER_ENGINE_MIN_INTERVAL)
+
+
+def start_price_stream(application):
+    global _price_stream_task, _order_engine_task
+    _order_engine_task = asyncio.create_task(run_order_engine(application))
+    _price_stream_task = asyncio.create_task(run_price_stream())
+
+
+async def stop_price_stream():
+    for task in (_price_stream_task, _order_engine_task):
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+
+# --- Trade Statistics ---
+def record_fills(user, rows):
+    """Fold fills (side, btc, usd, price, fee, timestamp), oldest first, into the user's stats.
+
+    Call before the balances change; each fill costs O(1).
+    """
+    stats = user.stats
+    usd, btc = user.usd, user.btc
+    for side, amount, value, price, fee, _ in rows:
+        stats.trades += 1
+        stats.fees += fee
+        if side == 'buy':
+            stats.cost += value
+            stats.volume += value
+            usd -= value
+            btc += amount
+        else:
+            # Average cost basis: the BTC sold carries its share of what the position cost
+            cost = stats.cost if amount >= btc else stats.cost * amount / btc
+            stats.cost -= cost
+            stats.realized += value - cost
+            stats.sells += 1
+            stats.wins += value > cost
+            stats.volume += amount * price
+            usd += value
+            btc -= amount
+
+        equity = usd + btc * price
+        stats.peak = max(stats.peak, equity)
+        stats.max_drawdown = max(stats.max_drawdown, 1 - equity / stats.peak)
+
+
+def rebuild_trade_stats():
+    """Give users without stats (new records, older snapshots) accumulators replayed from their trade history."""
+    rebuilt = 0
+    for user_id, user in USERS.items():
+        if user.stats is not None:
+            continue
+        replay = Account(to_micros(STARTING_USD), 0, None, None, 0, TradeStats())
+        record_fills(replay, [(TradeStore.SIDES[side], *values) for side, *values in TRADE_STORE._rows(user_id)])
+        user.stats = replay.stats
+        rebuilt += 1
+
+    if rebuilt:
+        logger.info(f"Rebuilt trade stats of {rebuilt} users from their trade history")
+
 
 # --- Trading Logic ---
-def execute_trade(user_id, action, usd_amount, context, btc_amount_override=None):
-    price = get_btc_price()
+def quote_fill(action, usd_amount, btc_amount, price):
+    """Integer amounts of a fill: (micro-dollars paid or received, satoshis, fee in micro-dollars).
+
+    Buys spend usd_amount including the fee; sells receive the proceeds of btc_amount net of it.
+    The BTC side rounds down, so a fill never hands out more than was paid for.
+    """
+    price_micros = to_micros(price)
+    if action == 'buy':
+        paid = to_micros(usd_amount)
+        fee = round(paid * TRADE_FEE)
+        return paid, (paid - fee) * SATS_PER_BTC // price_micros, fee
+
+    sats = to_sats(btc_amount)
+    gross = sats * price_micros // SATS_PER_BTC
+    fee = round(gross * TRADE_FEE)
+    return gross - fee, sats, fee
+
+
+def execute_trade(user_id, action, usd_amount, context, btc_amount_override=None, fill_price=None):
+    price = fill_price or get_btc_price()
     user = USERS[user_id]
 
     if usd_amount <= 0:
@@ -656,49 +3019,42 @@ def execute_trade(user_id, action, usd_amount, context, btc_amount_override=None
     if usd_amount < MIN_TRADE_AMOUNT:
         return False, f"❌ 🙈 Minimum trade amount is ${MIN_TRADE_AMOUNT:.2f}."
 
-    fee_multiplier = 1 - TRADE_FEE
-
     if action == 'buy':
-        if user['usd'] < usd_amount:
+        paid, sats, fee = quote_fill('buy', usd_amount, None, price)
+        if user.usd_micros < paid:
             return False, "❌ 🙈 Insufficient USD."
 
-        btc_bought = (usd_amount * fee_multiplier) / price
-        user['usd'] -= usd_amount
-        user['btc'] += btc_bought
-
-        user['trades'].append({
-            "type": "buy",
-            "btc": btc_bought,
-            "usd": usd_amount,
-            "price": price,
-            "fee_pct": TRADE_FEE * 100,
-            "timestamp": datetime.now().isoformat()
-        })
-        save_data()
+        btc_bought = sats / SATS_PER_BTC
+        row = ('buy', btc_bought, paid / MICROS_PER_USD, price, fee / MICROS_PER_USD, time.time())
+        record_fills(user, [row])
+        user.usd_micros -= paid
+        user.sats += sats
+
+        TRADE_STORE.append(user_id, *row)
+        journal_append('trade', user_id=user_id, usd=user.usd, btc=user.btc, stats=user.stats.to_dict())
+        LEADERBOARD.update_user(user_id)
+        CONTEST.update_user(user_id)
         return True, f"🐵 Bought {btc_bought:.6f} BTC for ${usd_amount:,.2f} @ ${price:,.2f}"
 
     elif action == 'sell':
-        price = get_btc_price()
         btc_to_sell = btc_amount_override if btc_amount_override else usd_amount / price
+        received, sats, fee = quote_fill('sell', None, btc_to_sell, price)
 
-        if user['btc'] < btc_to_sell:
+        if user.sats < sats:
             return False, "❌ 🙈 Insufficient BTC."
 
-        net_usd = (btc_to_sell * price) * (1 - TRADE_FEE)
-        user['btc'] -= btc_to_sell
-        user['usd'] += net_usd
+        btc_sold = sats / SATS_PER_BTC
+        net_usd = received / MICROS_PER_USD
+        row = ('sell', btc_sold, net_usd, price, fee / MICROS_PER_USD, time.time())
+        record_fills(user, [row])
+        user.sats -= sats
+        user.usd_micros += received
 
-        user['trades'].append({
-            "type": "sell",
-            "btc": btc_to_sell,
-            "usd": net_usd,
-            "price": price,
-            "fee_pct": TRADE_FEE * 100,
-            "timestamp": datetime.now().isoformat()
-        })
-
-        save_data()
-        return True, f"🐵 Sold {btc_to_sell:.6f} BTC for ${net_usd:,.2f} @ ${price:,.2f}"
+        TRADE_STORE.append(user_id, *row)
+        journal_append('trade', user_id=user_id, usd=user.usd, btc=user.btc, stats=user.stats.to_dict())
+        LEADERBOARD.update_user(user_id)
+        CONTEST.update_user(user_id)
+        return True, f"🐵 Sold {btc_sold:.6f} BTC for ${net_usd:,.2f} @ ${price:,.2f}"
 
 
     return False, "❌ 🙈 Invalid action."
@@ -706,6 +3062,209 @@ def execute_trade(user_id, action, usd_amount, context, btc_amount_override=None
 
 
 
+# --- Leaderboard ---
+class Leaderboard:
+    """Wealth ranking at one price, rebuilt for a newer price at most every refresh_interval seconds
+    and patched in place on balance changes."""
+
+    TOP_SIZE = 50
+
+    def __init__(self, refresh_interval):
+        self.refresh_interval = refresh_interval
+        self.price = None
+        self._ranked_at = 0.0  # monotonic time of the last full re-rank
+        self._keys = []  # (-wealth, number, user_id), best first
+        self._user_keys = {}
+        self._text = None
+
+    @staticmethod
+    def _key(user_id, user, price):
+        return (-(user.usd + user.btc * price), user.number, user_id)
+
+    def refresh(self, price):
+        """Re-rank everyone if the price moved, unless the ranking is younger than refresh_interval.
+
+        A streamed price changes several times a second; re-sorting every user on each call would
+        make the cache useless.
+        """
+        now = time.monotonic()
+        if self.price is not None and (price == self.price or now - self._ranked_at < self.refresh_interval):
+            return
+        self.price = price
+        self._ranked_at = now
+        self._user_keys = {uid: self._key(uid, user, price) for uid, user in USERS.items()}
+        self._keys = sorted(self._user_keys.values())
+        self._text = None
+
+    def update_user(self, user_id):
+        """Move one user to their new position after a balance change."""
+        if self.price is None:
+            return
+
+        old_key = self._user_keys.get(user_id)
+        old_pos = len(self._keys)
+        if old_key is not None:
+            old_pos = bisect.bisect_left(self._keys, old_key)
+            del self._keys[old_pos]
+
+        new_key = self._key(user_id, USERS[user_id], self.price)
+        new_pos = bisect.bisect_left(self._keys, new_key)
+        self._keys.insert(new_pos, new_key)
+        self._user_keys[user_id] = new_key
+
+        if min(old_pos, new_pos) < self.TOP_SIZE:
+            self._text = None
+
+    def rank(self, user_id):
+        """Return (position, total, wealth, key of the user ranked just above or None)."""
+        key = self._user_keys[user_id]
+        pos = bisect.bisect_left(self._keys, key)
+        above = self._keys[pos - 1] if pos > 0 else None
+        return pos + 1, len(self._keys), -key[0], above
+
+    def top_text(self):
+        if self._text is None:
+            medals = ["🥇", "🥈", "🥉"]
+            lines = []
+            for i, (neg_wealth, number, uid) in enumerate(self._keys[:self.TOP_SIZE]):
+                name = USERS[uid].display_name
+                pnl = -neg_wealth - STARTING_USD
+                lines.append(f"{medals[i]} {name} | PnL: ${pnl:,.2f}" if i < 3 else f"{i+1}. {name} | PnL: ${pnl:,.2f}")
+            self._text = "\n".join(lines)
+        return self._text
+
+
+LEADERBOARD = Leaderboard(LEADERBOARD_REFRESH_INTERVAL)
+
+
+# --- Contest ---
+class ContestEngine:
+    """Each trader's break-even price for the PnL target, kept sorted so a tick finds who just reached it.
+
+    Nobody can hold negative BTC, so PnL = usd + btc * price - STARTING_USD only rises with the
+    price, and a trader qualifies exactly when price >= (STARTING_USD + target - usd) / btc.
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.clear()
+
+    def clear(self):
+        self.price = None  # price of the last check
+        self._keys = []  # (threshold price, user_id), lowest first
+        self._prices = []  # thresholds alone, for bisecting
+        self._user_keys = {}
+        self._pending = set()  # users whose trade made them qualify at the last price
+        self.notified = set()  # users already counted as eligible; each is reported once
+
+    def threshold(self, user):
+        """Lowest price at which the user's PnL meets the target, or None if no price does."""
+        needed = STARTING_USD + self.target - user.usd
+        if needed <= 0:
+            return 0.0
+        if user.sats <= 0:
+            return None
+        return needed / user.btc
+
+    def rebuild(self):
+        self.clear()
+        for user_id, user in USERS.items():
+            threshold = self.threshold(user)
+            if threshold is not None:
+                self._user_keys[user_id] = (threshold, user_id)
+        self._keys = sorted(self._user_keys.values())
+        self._prices = [key[0] for key in self._keys]
+
+    def update_user(self, user_id):
+        """Move one user to their new threshold after a balance change."""
+        old_key = self._user_keys.pop(user_id, None)
+        if old_key is not None:
+            i = bisect.bisect_left(self._keys, old_key)
+            del self._keys[i]
+            del self._prices[i]
+
+        threshold = self.threshold(USERS[user_id])
+        if threshold is None:
+            return
+        key = (threshold, user_id)
+        i = bisect.bisect_left(self._keys, key)
+        self._keys.insert(i, key)
+        self._prices.insert(i, threshold)
+        self._user_keys[user_id] = key
+
+        if self.price is not None and threshold <= self.price:
+            self._pending.add(user_id)
+
+    def newly_eligible(self, price):
+        """Users who meet the target at this price and hadn't at the last check, each reported once."""
+        hi = bisect.bisect_right(self._prices, price)
+        lo = 0 if self.price is None else min(bisect.bisect_right(self._prices, self.price), hi)
+        candidates = [user_id for _, user_id in self._keys[lo:hi]]
+        candidates += [user_id for user_id in self._pending if self._user_keys.get(user_id, (math.inf,))[0] <= price]
+        self._pending.clear()
+        self.price = price
+
+        eligible = [user_id for user_id in dict.fromkeys(candidates) if user_id not in self.notified]
+        self.notified.update(eligible)
+        return eligible
+
+
+CONTEST = ContestEngine(CONTEST_PNL_TARGET)
+
+
+def get_pnl(user, price):
+    return user.usd + user.btc * price - STARTING_USD
+
+
+def award_prize(user_id, pnl):
+    """Record the winner and announce it to everyone else in the background.
+
+    Returns (message for the winner, announcement).
+    """
+    global WINNER_ID, WINNER_ANNOUNCED
+    WINNER_ID = user_id
+    WINNER_ANNOUNCED = True
+    journal_append('winner', winner_id=WINNER_ID, winner_announced=WINNER_ANNOUNCED)
+
+    winner_nickname = USERS[user_id].nickname or "A trader"
+    congrats = f"🎉 Congrats! 🏆 Message @Goldkingcoiner2 with your Bech32 BTC address to redeem your {CONTEST_PRIZE} winnings!"
+    announcement = f"🎉 {winner_nickname} has claimed the winnings with a ${pnl:,.2f} profit! The contest is over. See you next time!\n\n *New*: Join this channel for future contest announcements: https://t.me/Goldkingcoinerscontests"
+
+    # Everyone else is notified in the background at Telegram's flood limits
+    BROADCASTER.start_broadcast(announcement, [other_id for other_id in USERS if other_id != user_id])
+    logger.info(f"Prize awarded to {user_id} with PnL ${pnl:,.2f}")
+    return congrats, announcement
+
+
+def check_contest(price):
+    """Tick hook: tell traders who just reached the PnL target, or award the prize to the best of them."""
+    if WINNER_ID:
+        return
+
+    # The first check after a start only learns who already qualified; they were told before the restart
+    first_check = CONTEST.price is None
+    eligible = CONTEST.newly_eligible(price)
+    if not eligible:
+        return
+
+    if CONTEST_AUTO_AWARD:
+        winner_id = max(eligible, key=lambda user_id: get_pnl(USERS[user_id], price))
+        congrats, announcement = award_prize(winner_id, get_pnl(USERS[winner_id], price))
+        BROADCASTER.notify(winner_id, congrats)
+        BROADCASTER.notify(winner_id, announcement)
+        return
+
+    if first_check:
+        return
+    for user_id in eligible:
+        BROADCASTER.notify(
+            user_id,
+            f"🏆 Your PnL is ${get_pnl(USERS[user_id], price):,.2f}, past the ${CONTEST_PNL_TARGET:,.0f} target! "
+            f"Use /claimprize to claim the {CONTEST_PRIZE} prize."
+        )
+    METRICS.inc('contest_eligible_total', len(eligible))
+
+
 # --- Command Handlers ---
 @rate_limit_decorator
 async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -717,28 +3276,71 @@ async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_chat.send_message("❌ 🙈 You need to /register first.")
         return
             
-    price = get_btc_price()
-    rankings = []
+    # Reuses the ranking for up to LEADERBOARD_REFRESH_INTERVAL; trades patch it in place
+    LEADERBOARD.refresh(await fetch_btc_price())
+    top_traders_text = LEADERBOARD.top_text()
 
-    for uid, user in USERS.items():
-        name = user['nickname'] or f"Trader {user['number']}"
-        total_wealth = user["usd"] + (user["btc"] * price)
-        pnl = total_wealth - 100000.0  # Starting capital
-        rankings.append((name, total_wealth, pnl))
+    await update.effective_chat.send_message(f"* * * * 🏆 PnL Leaderboard 🏆 * * * *\n\n{top_traders_text}")
 
-    rankings.sort(key=lambda x: x[1], reverse=True)
-    top = rankings[:50]
 
-    medals = ["🥇", "🥈", "🥉"]
 
-    top_traders_text = "\n".join([
-        f"{medals[i]} {name} | PnL: ${pnl:,.2f}" if i < 3 else f"{i+1}. {name} | PnL: ${pnl:,.2f}"
-        for i, (name, wealth, pnl) in enumerate(top)
-    ])
 
-    await update.effective_chat.send_message(f"* * * * 🏆 PnL Leaderboard 🏆 * * * *\n\n{top_traders_text}")
+@rate_limit_decorator
+async def rank(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    if user_id not in USERS:
+        await update.effective_chat.send_message("❌ 🙈 You need to /register first.")
+        return
 
+    try:
+        LEADERBOARD.refresh(await fetch_btc_price())
+        position, total, wealth, above = LEADERBOARD.rank(user_id)
 
+        text = (
+            f"🏅 Your rank: #{position} of {total}\n"
+            f"💰 Total Value: ${wealth:,.2f}\n"
+            f"📈 PnL: ${wealth - STARTING_USD:,.2f}\n\n"
+        )
+        if above is None:
+            text += "👑 You're in first place!"
+        else:
+            neg_wealth, number, above_id = above
+            above_name = USERS[above_id].display_name
+            text += f"⬆️ ${-neg_wealth - wealth:,.2f} behind {above_name} (#{position - 1})"
+
+        await update.effective_chat.send_message(text)
+    except Exception as e:
+        logger.error(f"Rank error: {e}")
+        await update.effective_chat.send_message("❌ 🙈 Couldn't fetch your rank. Please try again later.")
+
+
+def render_history_page(user_id, page=0, before=None, after=None):
+    """Render one page of a user's trades (page 0 is the most recent) and its paging buttons.
+
+    Buttons carry the key of the page's edge trade, so the next page is read from there
+    instead of by skipping rows; the page number only labels it.
+    """
+    total = TRADE_STORE.count(user_id)
+    pages = max(1, -(-total // HISTORY_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+
+    trades, first_key, last_key = TRADE_STORE.window(user_id, HISTORY_PAGE_SIZE, before, after)
+    end = total - page * HISTORY_PAGE_SIZE
+    start = max(0, end - len(trades))
+
+    text = f"📜 {USERS[user_id].nickname}'s trades {start + 1}-{end} of {total}:\n\n"
+    for trade in trades:
+        emoji = "📗" if trade['type'] == 'buy' else "📕"
+        trade_type = trade['type'].capitalize()
+        text += f"{emoji}{trade_type}→${trade['usd']:,.2f} @${trade['price']:,.0f}\n"
+
+    buttons = []
+    if page < pages - 1 and first_key is not None:
+        buttons.append(InlineKeyboardButton("⬅️ Older", callback_data=f"history_{page + 1}_b_{first_key}"))
+    if page > 0 and last_key is not None:
+        buttons.append(InlineKeyboardButton("Newer ➡️", callback_data=f"history_{page - 1}_a_{last_key}"))
+
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
 
 
 @rate_limit_decorator
@@ -748,27 +3350,30 @@ async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.effective_chat.send_message("❌ 🙈 You need to /register first.")
         return
 
-    user = USERS[user_id]
-    trades = user.get("trades", [])
-    
-    if not trades:
+    if not TRADE_STORE.count(user_id):
         await update.effective_chat.send_message("❌ 🙈 You have no trades yet.")
         return
 
-    recent_trades = trades[-15:]
+    text, keyboard = render_history_page(user_id, 0)
+    await update.effective_chat.send_message(text, reply_markup=keyboard)
 
-    recent_trades_text = f"📜 {user['nickname']}'s 15 most recent trades:\n\n"
-    for trade in recent_trades:
-        emoji = "📗" if trade['type'] == 'buy' else "📕"
-        trade_type = trade['type'].capitalize()
-        trade_btc = trade['btc']
-        trade_usd = trade['usd']
-        trade_price = trade['price']
-        trade_time = trade['timestamp']
-        recent_trades_text += f"{emoji}{trade_type}→${trade_usd:,.2f} @${trade_price:,.0f}\n"
 
-    await update.effective_chat.send_message(recent_trades_text)
-  
+@rate_limited('callback')
+async def handle_history_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    user_id = str(query.from_user.id)
+
+    if user_id not in USERS:
+        await query.edit_message_text("❌ 🙈 You need to /register first.")
+        return
+
+    # history_<page>[_b_<key>|_a_<key>]; buttons from before keyed paging carry only the page and open the newest
+    page, _, rest = query.data.replace("history_", "").partition('_')
+    direction, _, key = rest.partition('_')
+    page = int(page) if key else 0
+    text, keyboard = render_history_page(user_id, page, key if direction == 'b' else None, key if direction == 'a' else None)
+    await query.edit_message_text(text, reply_markup=keyboard)
 
 
 @rate_limit_decorator
@@ -780,19 +3385,13 @@ async def portfolio(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         user = USERS[user_id]
-        total_value = user["usd"] + (user["btc"] * get_btc_price())
-        pnl = total_value - 100000.0
-        
-
-        display_name = user['nickname']
-
-        if not display_name:
-            display_name = f"Trader {user['number']}"
+        total_value = user.usd + (user.btc * await fetch_btc_price())
+        pnl = total_value - STARTING_USD
 
         response_text = (
             f"💰 Your Portfolio:\n\n"
-            f"USD: ${user['usd']:,.1f}\n"
-            f"BTC: {user['btc']:.5f} BTC\n"
+            f"USD: ${user.usd:,.1f}\n"
+            f"BTC: {user.btc:.5f} BTC\n"
             f"*Total Value: ${total_value:,.1f}*\n"
             f"📈 PnL: ${pnl:,.1f}\n"
         )
@@ -804,6 +3403,42 @@ async def portfolio(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 @rate_limit_decorator
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        user_id = str(update.effective_user.id)
+        if user_id not in USERS:
+            await update.effective_chat.send_message("❌ 🙈 You need to /register first.")
+            return
+
+        user = USERS[user_id]
+        totals = user.stats
+        if not totals.trades:
+            await update.effective_chat.send_message("❌ 🙈 No trades yet. Use /buy to get started.")
+            return
+
+        current_price = await fetch_btc_price()
+        unrealized = user.btc * current_price - totals.cost
+        avg_entry = f"${totals.cost / user.btc:,.2f}" if user.btc > 0 else "-"
+        win_rate = f"{totals.wins / totals.sells * 100:.0f}% of {totals.sells} sells" if totals.sells else "no sells yet"
+
+        response_text = (
+            f"📊 Your Trading Stats:\n\n"
+            f"🎯 Avg entry: {avg_entry} for {user.btc:.5f} BTC\n"
+            f"💵 Realized PnL: ${totals.realized:,.2f}\n"
+            f"📈 Unrealized PnL: ${unrealized:,.2f}\n"
+            f"💸 Fees paid: ${totals.fees:,.2f}\n"
+            f"🔁 Trades: {totals.trades} (${totals.volume:,.0f} volume)\n"
+            f"🏅 Win rate: {win_rate}\n"
+            f"📉 Max drawdown: {totals.max_drawdown * 100:.2f}% (measured at your trades)"
+        )
+
+        await update.effective_chat.send_message(response_text)
+    except Exception as e:
+        logger.error(f"Stats error: {e}")
+        await update.effective_chat.send_message("❌ 🙈 Couldn't fetch your stats. Please try again later.")
+
+
+@rate_limited('light')
 async def price(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = str(update.effective_user.id)
@@ -811,8 +3446,10 @@ async def price(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.effective_chat.send_message("❌ 🙈 You need to /register first.")
             return
 
+        current_price = await fetch_btc_price()
         response_text = (
-            f"📈 Current BTC Price: ${get_btc_price():,.2f}"  # Show Status
+            f"📈 Current BTC Price: ${current_price:,.2f}\n"
+            f"🕒 Updated {get_btc_price_age():.0f}s ago"
         )
         
         await update.effective_chat.send_message(response_text)
@@ -828,7 +3465,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.effective_chat.send_message(        
         "*To begin trading, use /register <your nickname here>*\n\n"
         "᛫ Use /help to see a list of available commands.\n\n"
-        "current prize - 0.25 mBTC\n\n"     
+        f"current prize - {CONTEST_PRIZE}\n\n"
         "Trading fee is 0.1%.\n\n"
         "See https://bitcointalk.org/index.php?topic=5540701.0 for Info and disclaimers\n\n"
         "*New*: Join this channel for future contest announcements: https://t.me/Goldkingcoinerscontests",    
@@ -862,28 +3499,21 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Ensure nickname uniqueness
     for user in USERS.values():
-        if user.get('nickname', '').lower() == nickname.lower():
+        if (user.nickname or '').lower() == nickname.lower():
             logger.warning(f"Name {nickname} is already taken.")
             await update.effective_chat.send_message("❌ 🙈 Name already taken. Choose another.")
             return
 
     # Register the user
     trader_count = len(USERS) + 1
-    USERS[user_id] = {
-        'usd': 100000.0,
-        'btc': 0.0,
-        'trades': [],
-        'nickname': nickname,
-        'username': username,
-        'number': trader_count  # ✅ comma added here
-
-        
-    }
+    USERS[user_id] = Account(to_micros(STARTING_USD), 0, nickname, username, trader_count, TradeStats())
 
 
 
-    # Save the data after registration
-    save_data()
+    # Record the registration
+    journal_append('register', user_id=user_id, user=USERS[user_id].to_dict())
+    LEADERBOARD.update_user(user_id)
+    CONTEST.update_user(user_id)
 
     # Confirm successful registration
     logger.info(f"User {nickname} registered successfully with data: {USERS[user_id]}")
@@ -929,71 +3559,267 @@ async def sell(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.effective_chat.send_message("How much of your BTC would you like to sell?", reply_markup=reply_markup)
 
 
-# Generate and save chart
-
-def fetch_btc_hourly_data():
-    try:
-        binance = ccxt.binance()
-        ohlcv = binance.fetch_ohlcv('BTC/USDT', timeframe='1h', limit=168)  # Last 7 days of 1-hour data
+# Generate and cache chart
+
+def backfill_candles(start_minute, end_minute):
+    """Download the closed 1-minute candles in [start_minute, end_minute) the archive is missing or built from ticks."""
+    gaps = CANDLE_ARCHIVE.gaps(start_minute, end_minute)
+    if not gaps:
+        return 0
+
+    import ccxt
+
+    binance = ccxt.binance()
+    stored = 0
+    for first, last in gaps:
+        since = first
+        while since <= last:
+            limit = min(CANDLE_BACKFILL_LIMIT, last - since + 1)
+            ohlcv = binance.fetch_ohlcv('BTC/USDT', timeframe='1m', since=since * 60000, limit=limit)
+            ohlcv = [row for row in ohlcv if row[0] // 60000 <= last]
+            if not ohlcv:
+                break  # the exchange has nothing for this stretch
+            CANDLE_ARCHIVE.store(ohlcv)
+            stored += len(ohlcv)
+            since = ohlcv[-1][0] // 60000 + 1
+    logger.info(f"Backfilled {stored} candles over {len(gaps)} gaps")
+    return stored
+
+def chart_start_minute(timeframe, window_minutes, now_minute):
+    """First minute of a chart window, aligned so the last candle is the one still open."""
+    step = CHART_TIMEFRAMES[timeframe][0]
+    return now_minute - now_minute % step - window_minutes + step
+
+def fetch_btc_candles(timeframe, start_minute):
+    """Candles from start_minute up to now, backfilling gaps when the exchange is reachable.
+
+    Closed candles of each timeframe are resampled once and reused until the next candle closes;
+    only the open candle is rebuilt per call. Runs in a chart worker process.
+    """
+    import pandas as pd
+
+    step, freq = CHART_TIMEFRAMES[timeframe]
+    now_minute = int(time.time() // 60)
+    open_start = now_minute - now_minute % step
+
+    cached = _candle_frames.get(timeframe)
+    if cached is None or cached[0] != open_start or cached[1] > start_minute:
+        try:
+            backfill_candles(start_minute, now_minute)  # the open minute comes from live ticks
+        except Exception as e:
+            logger.warning(f"Candle backfill failed, charting from the archive only: {e}")
+        cached = _candle_frames[timeframe] = (open_start, start_minute, CANDLE_ARCHIVE.frame(start_minute, open_start, freq))
+    else:
+        try:
+            backfill_candles(open_start, now_minute)
+        except Exception as e:
+            logger.warning(f"Candle backfill failed, charting from the archive only: {e}")
 
-        df = pd.DataFrame(ohlcv, columns=['Timestamp', 'Open', 'High', 'Low', 'Close', 'Volume'])
+    closed = cached[2]
+    df = pd.concat([closed[closed.index >= pd.Timestamp(start_minute * 60, unit='s', tz='UTC')],
+                    CANDLE_ARCHIVE.frame(open_start, now_minute + 1, freq)])
+    if df.empty:
+        logger.error("No BTC candles available")
+        raise Exception("Failed to fetch BTC data.")
 
-        # Convert the timestamp to a proper DateTime format (UTC -> CET)
-        df['Date'] = pd.to_datetime(df['Timestamp'], unit='ms', utc=True)
-        df['Date'] = df['Date'].dt.tz_convert('Europe/Berlin')  # Assuming CET/CEST time zone
+    df.index = df.index.tz_convert('Europe/Berlin')  # Assuming CET/CEST time zone
+    df.index.name = 'Date'
+    return df
 
-        df.set_index('Date', inplace=True)
-        return df[['Open', 'High', 'Low', 'Close', 'Volume']]
+# Function to render the chart to PNG bytes in memory
+def generate_btc_chart(data, title, trades=None, orders=None) -> bytes:
+    """Candlestick PNG, optionally with the user's trades as markers and open orders as level lines."""
+    mpf = import_mplfinance()
+    try:
+        addplots = []
+        if trades:
+            # One marker per candle and side, at the last trade price in that candle
+            candle_times = data.index.tz_convert('UTC').asi8 // 10**9
+            for side, marker, color in (('buy', '^', 'green'), ('sell', 'v', 'red')):
+                markers = np.full(len(data), np.nan)
+                for trade_side, price, timestamp in trades:
+                    i = bisect.bisect_right(candle_times, timestamp) - 1
+                    if trade_side == side and i >= 0:
+                        markers[i] = price
+                if not np.isnan(markers).all():
+                    addplots.append(mpf.make_addplot(markers, type='scatter', marker=marker, markersize=80, color=color))
+
+        kwargs = {}
+        if orders:
+            kwargs['hlines'] = dict(
+                hlines=[price for _, price in orders],
+                colors=['green' if order_type in ('buy', 'stopbuy') else 'red' for order_type, _ in orders],
+                linestyle='--', linewidths=1.2,
+            )
+        if addplots:
+            kwargs['addplot'] = addplots
 
-    except Exception as e:
-        logger.error(f"Error fetching BTC hourly data: {e}")
-        raise Exception("Failed to fetch BTC data.")
+        # Tick-built minutes carry no volume; without exchange candles (backfill offline) the panel would be flat
+        has_volume = bool((data['Volume'] > 0).any())
 
-# Function to generate and save the chart as an image
-def generate_btc_chart(data, filename="btc_hourly_chart.png"):
-    try:
-        mpf.plot(data, type='candle', style='charles', title='BTC/USD 1-Hour Chart', volume=True, savefig=filename)
-        logger.info(f"Chart generated and saved as {filename}")
+        buffer = io.BytesIO()
+        mpf.plot(data, type='candle', style='charles', title=title, volume=has_volume,
+                 savefig=dict(fname=buffer, format='png'), **kwargs)
+        return buffer.getvalue()
     except Exception as e:
         logger.error(f"Error generating chart: {e}")
         raise Exception("Failed to generate chart.")
 
+def render_btc_chart(timeframe, window, start_minute, trades=None, orders=None) -> bytes:
+    """Fetch and render one chart. Runs in a chart worker process."""
+    data = fetch_btc_candles(timeframe, start_minute)
+    return generate_btc_chart(data, f'BTC/USD {timeframe} Chart ({window})', trades, orders)
+
+def parse_chart_args(args):
+    """Return (timeframe, window label, window minutes, personal) for /chart [timeframe] [window] [me]."""
+    personal = 'me' in [arg.lower() for arg in args]
+    args = [arg.lower() for arg in args if arg.lower() != 'me']
+    if len(args) > 2:
+        raise ValueError("too many arguments")
+    timeframe = args[0] if args else CHART_DEFAULT_TIMEFRAME
+    window = args[1] if len(args) > 1 else CHART_DEFAULT_WINDOW
+    if timeframe not in CHART_TIMEFRAMES:
+        raise ValueError("unknown timeframe")
+
+    unit = CHART_WINDOW_UNITS.get(window[-1:])
+    if unit is None or not window[:-1].isdigit():
+        raise ValueError("bad window")
+    window_minutes = int(window[:-1]) * unit
+    candles = window_minutes // CHART_TIMEFRAMES[timeframe][0]
+    if not 2 <= candles <= CHART_MAX_CANDLES or window_minutes > CANDLE_HISTORY_MINUTES:
+        raise ValueError("window out of range")
+    return timeframe, window, window_minutes, personal
+
+def chart_cache_key(timeframe):
+    """Changes when a candle closes, and at least hourly so long candles still show the latest price."""
+    return int(time.time() // min(CHART_TIMEFRAMES[timeframe][0] * 60, 3600))
+
+async def get_btc_chart(timeframe=CHART_DEFAULT_TIMEFRAME, window=CHART_DEFAULT_WINDOW):
+    """Return the cached shared chart for this view, rendering it once if missing."""
+    _, _, window_minutes, _ = parse_chart_args([timeframe, window])
+    view = (timeframe, window)
+    candle_key = chart_cache_key(timeframe)
+    chart = _chart_cache.get(view)
+    if chart is not None and chart['key'] == candle_key:
+        _chart_cache.move_to_end(view)
+        return chart
+
+    # Single-flight: concurrent cache misses for the same view share one render
+    task = _chart_render_tasks.get(view)
+    if task is None or task.done():
+        start_minute = chart_start_minute(timeframe, window_minutes, int(time.time() // 60))
+        CANDLE_ARCHIVE.flush()  # the worker reads the open candle from the file
+        task = _chart_render_tasks[view] = asyncio.ensure_future(
+            CHART_POOL.run(render_btc_chart, timeframe, window, start_minute))
+        task.add_done_callback(lambda _, view=view: _chart_render_tasks.pop(view, None))
+
+    png = await asyncio.shield(task)
+    chart = _chart_cache.get(view)
+    if chart is None or chart['key'] != candle_key:
+        chart = _chart_cache[view] = {'key': candle_key, 'png': png, 'file_id': None}
+        while len(_chart_cache) > CHART_CACHE_SIZE:
+            _chart_cache.popitem(last=False)
+    return chart
+
+async def render_personal_chart(user_id, timeframe, window, window_minutes):
+    """Render a chart with the user's trades and open orders in the personal chart pool.
+
+    Returns None when the user already has a render running; raises PoolBusy when the pool is full.
+    """
+    if user_id in _personal_chart_jobs:
+        return None
+
+    start_minute = chart_start_minute(timeframe, window_minutes, int(time.time() // 60))
+    columns = TRADE_STORE.columns(user_id)
+    first = bisect.bisect_left(columns['timestamp'], start_minute * 60)
+    trades = [
+        (TradeStore.SIDES[side], price, timestamp)
+        for side, price, timestamp in zip(columns['side'][first:], columns['price'][first:], columns['timestamp'][first:])
+    ]
+    orders = [(order['type'], order['price']) for order in get_user_limit_orders(user_id)]
+
+    _personal_chart_jobs.add(user_id)
+    try:
+        CANDLE_ARCHIVE.flush()  # the worker reads the open candle from the file
+        return await PERSONAL_CHART_POOL.run(render_btc_chart, timeframe, window, start_minute, trades, orders)
+    finally:
+        _personal_chart_jobs.discard(user_id)
+
 # Function to handle the /chart command in the bot
-@rate_limit_decorator
+@rate_limited('heavy')
 async def send_chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     if user_id not in USERS:
         await update.effective_chat.send_message("❌ 🙈 You need to /register first.")
         return
 
-    chat_id = update.effective_chat.id
-    filename = 'btc_hourly_chart.png'
-    
-    # Send a progress message while the chart is being generated
-    progress_message = await context.bot.send_message(chat_id=chat_id, text="Generating chart... Please wait ⏳")
-    
     try:
-        # Fetch the data and generate the chart
-        data = fetch_btc_hourly_data()
-        generate_btc_chart(data, filename)
+        timeframe, window, window_minutes, personal = parse_chart_args(context.args or [])
+    except ValueError:
+        await update.effective_chat.send_message(
+            "How to use:\n\n /chart [timeframe] [window] [me]\n\n"
+            f"Timeframes: {', '.join(CHART_TIMEFRAMES)}\n"
+            f"Window: hours, days or weeks, e.g. 12h, 30d, 2w (up to {CHART_MAX_CANDLES} candles)\n"
+            "Add 'me' to show your trades and open orders.\n\n"
+            "Example: /chart 4h 30d me"
+        )
+        return
 
-        # Send the generated chart image to the user
-        with open(filename, 'rb') as f:
-            await context.bot.send_photo(chat_id=chat_id, photo=f, caption='📉 BTC/USD 1-Hour Chart')
+    chat_id = update.effective_chat.id
+    caption = f'📉 BTC/USD {timeframe} Chart ({window})'
+    progress_message = None
+
+    busy_text = "⏳ 🙈 Chart workers are busy. Try again in a minute."
+
+    try:
+        if personal:
+            # Answer busy right away rather than queue behind a full pool
+            if PERSONAL_CHART_POOL.busy():
+                await context.bot.send_message(chat_id=chat_id, text=busy_text)
+                return
+            progress_message = await context.bot.send_message(chat_id=chat_id, text="Generating chart... Please wait ⏳")
+            png = await render_personal_chart(user_id, timeframe, window, window_minutes)
+            if png is None:
+                await context.bot.send_message(chat_id=chat_id, text="⏳ 🙈 Your last chart is still rendering.")
+                return
+            await context.bot.send_photo(chat_id=chat_id, photo=png, caption=f'{caption} with your trades and orders')
+            return
 
-        # Delete the progress message after the chart is sent
-        await progress_message.delete()
+        chart = _chart_cache.get((timeframe, window))
+        if chart is None or chart['key'] != chart_cache_key(timeframe):
+            if CHART_POOL.busy() and (timeframe, window) not in _chart_render_tasks:
+                await context.bot.send_message(chat_id=chat_id, text=busy_text)
+                return
+            # Send a progress message while the chart is being generated
+            progress_message = await context.bot.send_message(chat_id=chat_id, text="Generating chart... Please wait ⏳")
+            chart = await get_btc_chart(timeframe, window)
+
+        # Reuse the image already uploaded to Telegram when we have one
+        if chart['file_id']:
+            try:
+                await context.bot.send_photo(chat_id=chat_id, photo=chart['file_id'], caption=caption)
+                return
+            except BadRequest as e:
+                logger.warning(f"Cached chart file_id rejected, re-uploading: {e}")
+                chart['file_id'] = None
+
+        message = await context.bot.send_photo(chat_id=chat_id, photo=chart['png'], caption=caption)
+        if message.photo:
+            chart['file_id'] = message.photo[-1].file_id
+
+    except PoolBusy:
+        await context.bot.send_message(chat_id=chat_id, text=busy_text)
 
     except Exception as e:
         # If an error occurred, send an error message
         await context.bot.send_message(chat_id=chat_id, text=f"❌ 🙈 Error: {e}")
-        await progress_message.delete()
 
     finally:
-        # Clean up: Remove the generated chart file after sending it
-        if os.path.exists(filename):
-            os.remove(filename)
+        # Delete the progress message once the chart is sent or failed
+        if progress_message is not None:
+            await progress_message.delete()
             
+@rate_limited('callback')
 async def handle_trade_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -1007,13 +3833,14 @@ async def handle_trade_callback(update: Update, context: ContextTypes.DEFAULT_TY
         action, percent_str = query.data.split('_')
         percent = int(percent_str)
         user = USERS[user_id]
+        await fetch_btc_price()
 
         if action == 'buy':
-            usd_available = user['usd']
+            usd_available = user.usd
             usd_amount = (percent / 100) * usd_available
             success, message = execute_trade(user_id, 'buy', usd_amount, context)
         elif action == 'sell':
-            btc_value_in_usd = user['btc'] * get_btc_price()
+            btc_value_in_usd = user.btc * await fetch_btc_price()
             usd_amount = (percent / 100) * btc_value_in_usd
             success, message = execute_trade(user_id, 'sell', usd_amount, context)
         else:
@@ -1026,7 +3853,18 @@ async def handle_trade_callback(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def process_limit_orders_callback(context: CallbackContext):
     """Background task to process limit orders periodically."""
+    global _last_order_tick
+
+    # How late this run started relative to its schedule
+    now = time.monotonic()
+    if _last_order_tick is not None:
+        METRICS.observe('order_job_lag_seconds', max(0.0, now - _last_order_tick - ORDER_TICK_INTERVAL))
+    _last_order_tick = now
+
     try:
+        if not PRICE_STREAM_ENABLED:
+            # Polling only samples the price; fill in the highs and lows between samples
+            await refresh_price_range()
         executed_orders = await process_limit_orders(context)
 
         if executed_orders:
@@ -1036,7 +3874,6 @@ async def process_limit_orders_callback(context: CallbackContext):
 
 @rate_limit_decorator
 async def claimprize(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global WINNER_ID, WINNER_ANNOUNCED
     user_id = str(update.effective_user.id)
 
     if user_id not in USERS:
@@ -1044,9 +3881,8 @@ async def claimprize(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     user = USERS[user_id]
-    price = get_btc_price()
-    total_value = user["usd"] + (user["btc"] * price)
-    pnl = total_value - 100000.0
+    price = await fetch_btc_price()
+    pnl = get_pnl(user, price)
 
     # If someone already won
     if WINNER_ID:
@@ -1056,7 +3892,7 @@ async def claimprize(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         else:
             winner_data = USERS.get(WINNER_ID)
-            winner_nickname = winner_data.get("nickname", "Unknown") if winner_data else "Unknown"
+            winner_nickname = (winner_data.nickname or "Unknown") if winner_data else "Unknown"
             await update.effective_chat.send_message(
                 f"❌ Winnings have already been claimed by *{winner_nickname}*. The contest is over. See you next time!\n\n *New*: Join this channel for future contest announcements: https://t.me/Goldkingcoinerscontests",
                 parse_mode="Markdown"
@@ -1064,75 +3900,356 @@ async def claimprize(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # No winner yet — check eligibility
-    if pnl >= 3000 and not WINNER_ANNOUNCED:
-        WINNER_ID = user_id
-        WINNER_ANNOUNCED = True
-        winner_nickname = user.get("nickname", "A trader")
-        save_data()
-
-        await update.effective_chat.send_message(f"🎉 Congrats! 🏆 Message @Goldkingcoiner2 with your Bech32 BTC address to redeem your winnings!")
-
-        # Broadcast with rate-limiting 
-        for other_id, other_user in USERS.items():
-            if other_id != user_id:
-                try:
-                    await context.bot.send_message(
-                        chat_id=other_id,
-                        text=f"🎉 {winner_nickname} has claimed the winnings with a ${pnl:,.2f} profit! The contest is over. See you next time!\n\n *New*: Join this channel for future contest announcements: https://t.me/Goldkingcoinerscontests"
-                    )
-                    await asyncio.sleep(3)  # 3s delay
-                except Exception as e:
-                    logger.warning(f"Failed to notify user {other_id}: {e}")
-        else:
-            await update.effective_chat.send_message(
-                f"🎉 {winner_nickname} has claimed the winnings with a ${pnl:,.2f} profit! The contest is over. See you next time!\n\n *New*: Join this channel for future contest announcements: https://t.me/Goldkingcoinerscontests"
-            )
+    if pnl >= CONTEST_PNL_TARGET and not WINNER_ANNOUNCED:
+        congrats, announcement = award_prize(user_id, pnl)
+        await update.effective_chat.send_message(congrats)
+        await update.effective_chat.send_message(announcement)
 
     else:
         await update.effective_chat.send_message(
-            f"❌ 🙈 Your current PnL is ${pnl:,.2f}. You need a PnL of $3,000 to claim the winnings."
+            f"❌ 🙈 Your current PnL is ${pnl:,.2f}. You need a PnL of ${CONTEST_PNL_TARGET:,.0f} to claim the winnings."
         )
 
 
 
+# --- Metrics Export ---
+def collect_metrics():
+    """Refresh gauges and counters that are owned by other components."""
+    for command, rejected in RATE_LIMITER.rejections.items():
+        METRICS.counters[('rate_limit_rejections_total', (('command', command),))] = rejected
+    METRICS.set('users', len(USERS))
+    METRICS.set('open_orders', len(LIMIT_ORDERS))
+    METRICS.set('price_alerts', len(ALERTS))
+    METRICS.set('outbound_queue', len(BROADCASTER._notifications))
+    METRICS.set('price_age_seconds', get_btc_price_age())
+
+
+async def start_metrics_server(port):
+    async def handle_metrics(request):
+        collect_metrics()
+        return web.Response(text=METRICS.render_prometheus(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    logger.info(f"Prometheus metrics on http://127.0.0.1:{port}/metrics")
+    return runner
+
+
+def _ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:g}"
+
+
+@rate_limit_decorator
+async def metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin-only summary of handler latency and hot-path counters."""
+    if str(update.effective_user.id) not in ADMIN_IDS:
+        return
+
+    collect_metrics()
+    lines = ["📊 Handler latency (count | p50 | p99 ms, bucket upper bounds):"]
+    for (name, labels), histogram in sorted(METRICS.histograms.items()):
+        if name == 'handler_seconds':
+            lines.append(f"᛫ {dict(labels)['handler']}: {histogram.count} | {_ms(histogram.quantile(0.5))} | {_ms(histogram.quantile(0.99))}")
+
+    lines.append("\n⚙️ Hot paths (count | p50 | p99 ms):")
+    for (name, labels), histogram in sorted(METRICS.histograms.items()):
+        if name != 'handler_seconds':
+            label_text = ",".join(str(v) for _, v in labels)
+            lines.append(f"᛫ {name}{f'[{label_text}]' if label_text else ''}: {histogram.count} | {_ms(histogram.quantile(0.5))} | {_ms(histogram.quantile(0.99))}")
+
+    lines.append("\n🔢 Counters:")
+    for (name, labels), value in sorted(METRICS.counters.items()):
+        label_text = ",".join(str(v) for _, v in labels)
+        lines.append(f"᛫ {name}{f'[{label_text}]' if label_text else ''}: {value:g}")
+
+    lines.append("\n📏 Gauges:")
+    for (name, labels), value in sorted(METRICS.gauges.items()):
+        label_text = ",".join(str(v) for _, v in labels)
+        lines.append(f"᛫ {name}{f'[{label_text}]' if label_text else ''}: {value:g}")
+
+    text = "\n".join(lines)
+    # Telegram caps messages at 4096 characters
+    for i in range(0, len(text), 4000):
+        await update.effective_chat.send_message(text[i:i + 4000])
+
+
+# --- Startup ---
+NEWS_MODULES = ('feedparser', 'rapidfuzz')  # only /news needs these; chart workers import the chart libraries
+STARTUP_TIMES = {}  # phase -> seconds: import, load, first_poll (since the module started importing), warm_imports
+_warmup_task = None
+
+
+def import_mplfinance():
+    """mplfinance with the non-GUI matplotlib backend, imported on first use."""
+    import matplotlib
+    matplotlib.use('Agg')  # Use non-GUI backend
+    import mplfinance
+    return mplfinance
+
+
+def import_news_modules():
+    for name in NEWS_MODULES:
+        importlib.import_module(name)
+
+
+def _chart_worker_ready():
+    return None
+
+
+async def warm_imports():
+    """Import the news libraries and start a worker in each chart pool, so the first /chart or /news doesn't wait."""
+    start = time.perf_counter()
+    await asyncio.gather(
+        IO_POOL.run(import_news_modules, admit=False),
+        *(pool.run(_chart_worker_ready, admit=False) for pool in (CHART_POOL, PERSONAL_CHART_POOL)),
+    )
+    record_startup_phase('warm_imports', time.perf_counter() - start)
+
+
+async def ensure_warm_imports():
+    """Run the warm-up once; later callers wait for the same run."""
+    global _warmup_task
+    if _warmup_task is None:
+        _warmup_task = asyncio.ensure_future(warm_imports())
+    await asyncio.shield(_warmup_task)
+
+
+def record_startup_phase(phase, seconds):
+    STARTUP_TIMES[phase] = seconds
+    METRICS.set('startup_seconds', seconds, phase=phase)
+
+
+def init():
+    """Load the persistent state. Importing the module does no I/O; call this once before serving."""
+    start = time.perf_counter()
+    load_data()
+    record_startup_phase('load', time.perf_counter() - start)
+
+
+def on_first_poll():
+    """Report the startup timings once Telegram answers the first getUpdates, then start the warm-up."""
+    record_startup_phase('first_poll', time.perf_counter() - _import_started)
+    logger.info(f"Startup: import {STARTUP_TIMES['import']:.2f}s, load {STARTUP_TIMES.get('load', 0):.2f}s, "
+                f"first poll answered {STARTUP_TIMES['first_poll']:.2f}s after start")
+    asyncio.ensure_future(ensure_warm_imports())
+
+
+# --- Update Processing ---
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Handles up to max_concurrent_updates updates at once, but each user's updates one at a time.
+
+    Two quick taps on the same button therefore can't both pass a balance check.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._user_locks = {}  # user id -> [lock, updates holding or waiting for it]
+        self.in_flight = 0
+
+    async def do_process_update(self, update, coroutine):
+        user = getattr(update, 'effective_user', None)
+        self.in_flight += 1
+        METRICS.set('updates_in_flight', self.in_flight)
+        try:
+            if user is None:
+                await coroutine
+                return
+
+            entry = self._user_locks.setdefault(user.id, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    await coroutine
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._user_locks[user.id]
+        finally:
+            self.in_flight -= 1
+            METRICS.set('updates_in_flight', self.in_flight)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+async def start_webhook_server(application, listen, port, path, secret=None):
+    """Accept Telegram's webhook POSTs and queue them for the application; returns the aiohttp runner."""
+    async def handle_update(request):
+        if secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except ValueError:
+            return web.Response(status=400)
+        METRICS.inc('webhook_updates_total')
+        await application.update_queue.put(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, listen, port).start()
+    logger.info(f"Webhook server on http://{listen}:{port}{path}")
+    return runner
+
+
+async def run_webhook(application):
+    """Serve updates through a webhook until SIGINT/SIGTERM, with the same startup and shutdown as polling."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    path = urlparse(WEBHOOK_URL).path or '/'
+    runner = await start_webhook_server(application, WEBHOOK_LISTEN, WEBHOOK_PORT, path, WEBHOOK_SECRET)
+    try:
+        async with application:
+            await on_startup(application)
+            await application.start()
+            await application.bot.set_webhook(
+                WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES,
+                max_connections=min(MAX_CONCURRENT_UPDATES, 100)  # Telegram allows at most 100
+            )
+            await stop.wait()
+            await application.stop()
+    finally:
+        await runner.cleanup()
+        await on_shutdown(application)
+
+
 # --- Main Bot Setup ---
-def main():
-    application = ApplicationBuilder().token(TOKEN).build()
-
-   
-    application.add_handler(CommandHandler("news", news))
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("leaderboard", leaderboard))
-    application.add_handler(CommandHandler("history", history))
-    application.add_handler(CommandHandler("portfolio", portfolio))
-    application.add_handler(CommandHandler("price", price))
-    application.add_handler(CommandHandler("buy", buy))
-    application.add_handler(CommandHandler("sell", sell))    
-    application.add_handler(CommandHandler("chart", send_chart))
-    application.add_handler(CommandHandler("register", register))
-    application.add_handler(CommandHandler("limitbuy", limitbuy))
-    application.add_handler(CommandHandler("limitsell", limitsell))
-    application.add_handler(CommandHandler("myorders", my_orders))
-    application.add_handler(CommandHandler("stopbuy", stopbuy))
-    application.add_handler(CommandHandler("stopsell", stopsell))
-    application.add_handler(CommandHandler("claimprize", claimprize))
-
-    application.add_handler(CallbackQueryHandler(handle_cancel_order_button, pattern=r"^cancelorder_"))
-    application.add_handler(CallbackQueryHandler(handle_cancel_all_button, pattern=r"^cancelall$"))
-    application.add_handler(CallbackQueryHandler(handle_trade_callback, pattern=r"^(buy|sell)_\d+$"))
-
-
-    
+async def on_startup(application):
+    """Start the background services; the sender resumes any broadcast left unfinished by a restart."""
+    global _metrics_runner
+    BROADCASTER.start(application.bot)
+    if PRICE_STREAM_ENABLED:
+        start_price_stream(application)
+    if METRICS_PORT:
+        _metrics_runner = await start_metrics_server(METRICS_PORT)
+
+
+async def on_shutdown(application):
+    """Close network sessions and write a final snapshot so the next start has nothing to replay."""
+    await stop_price_stream()
+    CANDLE_ARCHIVE.flush()
+    await BROADCASTER.stop()
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+    await close_price_session()
+    await close_news_session()
+    # Wait out a compaction still writing in the I/O pool before the final snapshot
+    async with SNAPSHOT_LOCK, ENGINE_LOCK:
+        shutdown_offload_pools()
+        save_data()
+    STORAGE.close()
+
+
+def add_handlers(application):
+    """Register every command and button handler on the application."""
+    application.add_handler(CommandHandler("news", instrumented(news)))
+    application.add_handler(CommandHandler("start", instrumented(start)))
+    application.add_handler(CommandHandler("help", instrumented(help_command)))
+    application.add_handler(CommandHandler("leaderboard", instrumented(leaderboard)))
+    application.add_handler(CommandHandler("rank", instrumented(rank)))
+    application.add_handler(CommandHandler("history", instrumented(history)))
+    application.add_handler(CommandHandler("portfolio", instrumented(portfolio)))
+    application.add_handler(CommandHandler("stats", instrumented(stats)))
+    application.add_handler(CommandHandler("price", instrumented(price)))
+    application.add_handler(CommandHandler("buy", instrumented(buy)))
+    application.add_handler(CommandHandler("sell", instrumented(sell)))    
+    application.add_handler(CommandHandler("chart", instrumented(send_chart)))
+    application.add_handler(CommandHandler("register", instrumented(register)))
+    application.add_handler(CommandHandler("limitbuy", instrumented(limitbuy)))
+    application.add_handler(CommandHandler("limitsell", instrumented(limitsell)))
+    application.add_handler(CommandHandler("myorders", instrumented(my_orders)))
+    application.add_handler(CommandHandler("stopbuy", instrumented(stopbuy)))
+    application.add_handler(CommandHandler("stopsell", instrumented(stopsell)))
+    application.add_handler(CommandHandler("alert", instrumented(alert)))
+    application.add_handler(CommandHandler("alerts", instrumented(alerts)))
+    application.add_handler(CommandHandler("claimprize", instrumented(claimprize)))
+    application.add_handler(CommandHandler("broadcasts", instrumented(broadcasts)))
+    application.add_handler(CommandHandler("metrics", instrumented(metrics)))
+
+    application.add_handler(CallbackQueryHandler(instrumented(handle_cancel_order_button), pattern=r"^cancelorder_"))
+    application.add_handler(CallbackQueryHandler(instrumented(handle_cancel_all_button), pattern=r"^cancelall$"))
+    application.add_handler(CallbackQueryHandler(instrumented(handle_cancel_alert_button), pattern=r"^cancelalert_"))
+    application.add_handler(CallbackQueryHandler(instrumented(handle_trade_callback), pattern=r"^(buy|sell)_\d+$"))
+    application.add_handler(CallbackQueryHandler(instrumented(handle_history_page), pattern=r"^history_\d+(_[ab]_[\d.:e+-]+)?$"))
+
+
+def schedule_jobs(application):
+    """Start the background jobs: price refresh, news polling, order processing and compaction."""
+    # Keep the cached BTC price fresh off the handler path
+    application.job_queue.run_repeating(
+        refresh_price_callback,
+        interval=PRICE_REFRESH_INTERVAL,
+        first=0.0
+    )
+
+    # Poll the news feeds in the background
+    application.job_queue.run_repeating(
+        refresh_news_callback,
+        interval=NEWS_REFRESH_INTERVAL,
+        first=1.0
+    )
+
     # Start a background task to check limit orders periodically
     application.job_queue.run_repeating(
         process_limit_orders_callback, 
-        interval=30.0,  # Check every 30 seconds
+        interval=ORDER_TICK_INTERVAL,
         first=10.0      # Start after 10 seconds
     )
-    
-   
-    application.run_polling()
+
+    # Periodically fold the journal into a snapshot
+    application.job_queue.run_repeating(
+        compact_data_callback,
+        interval=COMPACT_INTERVAL,
+        first=COMPACT_INTERVAL
+    )
+
+
+def application_builder(token, max_concurrent=MAX_CONCURRENT_UPDATES):
+    """Builder with the bot's transports and update processor; main() and the benchmark share it."""
+    return (
+        ApplicationBuilder()
+        .token(token)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .get_updates_request(InstrumentedRequest())  # getUpdates has its own transport; it drives on_first_poll
+        .concurrent_updates(PerUserUpdateProcessor(max_concurrent))
+    )
+
+
+def main():
+    init()
+    if sys.argv[1:] == ['migrate-sqlite']:
+        sys.exit(0 if migrate_to_sqlite() else 1)
+
+    application = (
+        application_builder(TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+
+    add_handlers(application)
+    schedule_jobs(application)
+
+    if BOT_MODE == 'webhook':
+        if not WEBHOOK_URL:
+            sys.exit("BOT_MODE=webhook needs WEBHOOK_URL")
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
+
+
+record_startup_phase('import', time.perf_counter() - _import_started)
 
 if __name__ == "__main__":
     main()